@@ -3,18 +3,29 @@
 Creates a snapshot of for one index.
 '''
 import os
+import gzip
+import json
 import requests
 from datetime import datetime, timedelta
 import async_timeout
 import asyncio
+from collections import namedtuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Any
 
 import boto3
-from boto3.s3.transfer import S3Transfer
+from botocore.config import Config
 import aiohttp
 
 from elasticsearch import Elasticsearch
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 AWS_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY')
 assert AWS_ACCESS_KEY is not None
 
@@ -34,143 +45,778 @@ assert ELASTICSEARCH_PORT is not None
 # environment as we use a fake S3 service
 S3_ENDPOINT = os.getenv('S3_ENDPOINT')
 
+# every block of an archive is compressed into an independent frame,
+# gzip (default), zstd (requires zstandard, also on the workers) or none
+ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', 'gzip')
+assert ARCHIVE_COMPRESSION in ('gzip', 'zstd', 'none')
+assert ARCHIVE_COMPRESSION != 'zstd' or zstandard is not None
+
+# the logs of one day are archived into one object (default),
+# or into one object per hour (data-{id}-YYYY-MM-DD/HH) for the large services
+ARCHIVE_PARTITION = os.getenv('ARCHIVE_PARTITION', 'day')
+assert ARCHIVE_PARTITION in ('day', 'hour')
+
+# archives are uploaded while they are exported, by parts of this size
+# (at least 5MB, as required by S3), at most this amount of parts at once
+SNAPSHOT_PART_BYTES = int(
+    os.getenv('SNAPSHOT_PART_BYTES', 8 * 1024 * 1024)
+)
+assert SNAPSHOT_PART_BYTES >= 5 * 1024 * 1024
+SNAPSHOT_UPLOADED_PARTS = int(
+    os.getenv('SNAPSHOT_UPLOADED_PARTS', 4)
+)
+
+# amount of indices exported at the same time (largest first),
+# threads running the S3 requests and removing the exported logs from ES,
+# maximum amount of search and scroll requests per second sent to ES
+# for all the indices (0 for no limit)
+SNAPSHOT_INDICES = int(
+    os.getenv('SNAPSHOT_INDICES', 4)
+)
+SNAPSHOT_THREADS = int(
+    os.getenv('SNAPSHOT_THREADS', 16)
+)
+SNAPSHOT_ELASTICSEARCH_REQUESTS_PER_SECOND = float(
+    os.getenv('SNAPSHOT_ELASTICSEARCH_REQUESTS_PER_SECOND', 20)
+)
+
+# every index is exported by this amount of sliced scrolls at the same time,
+# every slice is written into its own archives
+# (data-{id}-YYYY-MM-DD/S or data-{id}-YYYY-MM-DD/HH/S),
+# listed by the index of the day; logs are got by pages of this size
+SNAPSHOT_SLICES = int(
+    os.getenv('SNAPSHOT_SLICES', 1)
+)
+assert SNAPSHOT_SLICES >= 1
+SNAPSHOT_PAGE_SIZE = int(
+    os.getenv('SNAPSHOT_PAGE_SIZE', 1000)
+)
+
 ELASTICSEARCH_ENDPOINT = 'http://{}:9200'.format(ELASTICSEARCH_HOSTNAME)
-SNAPSHOTS_DIRECTORY = '/tmp'
 SNAPSHOT_DAYS_FROM_NOW = 10
-LOGS_FILES_OPEN_METHOD = 'w'
 ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS = 10
-ELASTICSEARCH_MAXIMUM_RESULTS_PER_PAGE = 10
 ELASTICSEARCH_SEARCH_CONTEXT_LIFETIME = '1m'  # 1 minute
+ELASTICSEARCH_FILTER_PATH = '_scroll_id,hits.hits._source'
+
+# the index of an archive lists its blocks of lines with their dates range,
+# as [first date, last date, offset, length], so the logs of a dates range
+# can be got from S3 without getting the whole archive;
+# a block is closed once it reaches this size (before compression),
+# the logs of one date may be split into two blocks
+ARCHIVE_INDEX_SUFFIX = '.index'
+ARCHIVE_BLOCK_BYTES = 256 * 1024
+GZIP_COMPRESSION_LEVEL = 6
+ZSTD_COMPRESSION_LEVEL = 3
+# position of HH into YYYY-MM-DDTHH:MM:SS
+HOUR_START = 11
+HOUR_END = 13
+# the index of the day of a partitioned archive (by hour or by slice)
+# lists its partitions as [first date, last date, key]
+PARTITION_KEY_SEPARATOR = '/'
 
 
 def _get_data_indices() -> list:
     '''
-    Returns the list of data indices (data-* format).
+    Returns the list of data indices (data-* format) to snapshot,
+    from the largest one; indices without logs are ignored
+    (the logs of a snapshot index are removed but the index remains,
+    its archive must not be replaced by an empty one).
     '''
     now = datetime.now()
     snapshot_datetime = now - timedelta(days=SNAPSHOT_DAYS_FROM_NOW)
 
-    indices = requests.get(ELASTICSEARCH_ENDPOINT + '/_aliases')
-    return [
+    indices = requests.get(
+        ELASTICSEARCH_ENDPOINT + '/_cat/indices/data-*',
+        params={
+            'format': 'json',
+            'bytes': 'b',
+            'h': 'index,docs.count,store.size',
+        },
+    )
+    indices = [
         index
         for index
         in indices.json()
         if (
-            index[:1] != '.' and
+            # closed indices have no documents count
+            int(index['docs.count'] or 0) > 0 and
             # takes only the date part of the index name,
             # turn it into a datetime object, compare interval with now
             datetime.strptime(
-                '-'.join(index.split('-')[2:]),
+                '-'.join(index['index'].split('-')[2:]),
                 '%Y-%m-%d',
             ) <= snapshot_datetime
         )
     ]
 
+    return [
+        index['index']
+        for index in sorted(
+            indices,
+            key=lambda index: int(index['store.size']),
+            reverse=True,
+        )
+    ]
+
+
+class _RateLimiter:
+    '''
+    Spaces the requests sent to ES by all the exported indices.
+    '''
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        requests_per_second: float=SNAPSHOT_ELASTICSEARCH_REQUESTS_PER_SECOND,
+    ):
+        self._loop = loop
+        self._interval = (
+            1 / requests_per_second if requests_per_second > 0 else 0
+        )
+        self._next_request_time = 0
+
+    async def wait(self):
+        '''
+        Coroutine that waits for the next request to be allowed.
+        '''
+        now = self._loop.time()
+        request_time = max(now, self._next_request_time)
+        self._next_request_time = request_time + self._interval
+
+        if request_time > now:
+            await asyncio.sleep(
+                request_time - now,
+                loop=self._loop,
+            )
+
 
 def _get_log_to_string(log: Any) -> str:
     '''
-    Returns a string representation of the given log.
-    Convert single quotes to double quotes in order to match with JSON format
-    (required for streaming)
+    Returns the JSON representation of the given log, as one line
+    starting with its date (read without decoding the line by the workers).
     '''
-    return str(log['_source']).replace("'", '"') + '\n'
+    source = OrderedDict([('date', log['_source']['date'])])
+    source.update(log['_source'])
 
+    return json.dumps(source) + '\n'
 
-async def _get_logs_from_elasticsearch(index_name: str) -> dict:
+
+def _get_compressor(compression: str) -> Any:
     '''
-    Generate the dump for the given index
-    and stores it into the snapshots directory.
+    Returns the function compressing one block into one frame.
     '''
-    async with aiohttp.ClientSession() as session:
-        with async_timeout.timeout(ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS):
-            async with session.get(
-                'http://{}:{}/{}/_search?scroll={}'.format(
-                    ELASTICSEARCH_HOSTNAME,
-                    ELASTICSEARCH_PORT,
-                    index_name,
-                    ELASTICSEARCH_SEARCH_CONTEXT_LIFETIME,
-                ),
-                json={
-                    'size': ELASTICSEARCH_MAXIMUM_RESULTS_PER_PAGE,
-                }
-            ) as response:
-                return await response.json()
+    if compression == 'gzip':
+        return lambda data: gzip.compress(data, GZIP_COMPRESSION_LEVEL)
 
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL).compress
 
-async def _scroll_logs_from_elasticsearch(scroll_id: str) -> dict:
+    return bytes
+
+
+class _ArchiveWriter:
     '''
-    Scroll the next page of found results from Elasticsearch.
+    Writes the logs of one archive, one log per line,
+    block after block, and lists the blocks of the archive;
+    every block is compressed into one frame that can be read alone.
     '''
-    # TODO: #123 we use a new session for one request here;
-    # if we try to use the same session as before,
-    # then not all the logs are returned from ES;
-    # we have to investigate how to organize the session(s) here
-    async with aiohttp.ClientSession() as session:
-        with async_timeout.timeout(ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS):
-            async with session.get(
-                'http://{}:{}/_search/scroll'.format(
-                    ELASTICSEARCH_HOSTNAME,
-                    ELASTICSEARCH_PORT,
+
+    def __init__(
+        self,
+        output: Any,
+        compression: str=ARCHIVE_COMPRESSION,
+    ):
+        self._output = output
+        self._compress = _get_compressor(compression)
+        self._offset = 0
+        self._blocks = []
+        self._block = None
+        self._lines = []
+        self._block_bytes = 0
+
+    def _write_block(self):
+        '''
+        Writes the current block at the end of the archive.
+        '''
+        if self._block is None:
+            return
+
+        frame = self._compress(b''.join(self._lines))
+        self._output.write(frame)
+
+        self._block[2] = self._offset
+        self._block[3] = len(frame)
+        self._blocks.append(self._block)
+        self._offset += len(frame)
+
+        self._block = None
+        self._lines = []
+        self._block_bytes = 0
+
+    def write(self, log: Any):
+        '''
+        Adds the given log at the end of the archive.
+        '''
+        line = _get_log_to_string(log).encode()
+        date = log['_source']['date']
+
+        if self._block_bytes >= ARCHIVE_BLOCK_BYTES:
+            self._write_block()
+
+        if self._block is None:
+            self._block = [date, date, 0, 0]
+
+        self._lines.append(line)
+        self._block_bytes += len(line)
+
+        self._block[0] = min(self._block[0], date)
+        self._block[1] = max(self._block[1], date)
+
+    def close(self):
+        '''
+        Writes the last block.
+        '''
+        self._write_block()
+
+    def get_dates_range(self) -> list:
+        '''
+        Returns the first and the last dates of the written archive.
+        '''
+        return [
+            min(block[0] for block in self._blocks),
+            max(block[1] for block in self._blocks),
+        ]
+
+    def get_index(self) -> str:
+        '''
+        Returns the JSON index of the written archive.
+        '''
+        return json.dumps({'blocks': self._blocks})
+
+
+class _MultipartUpload:
+    '''
+    Uploads one object into S3 while it is written, part after part,
+    without storing it on disk; the parts are uploaded by threads
+    while the next logs are exported, at most the given amount at once.
+
+    Objects smaller than one part are uploaded at once when closed.
+    '''
+
+    def __init__(
+        self,
+        s3_client: Any,
+        key: str,
+        loop: asyncio.AbstractEventLoop,
+        part_bytes: int=SNAPSHOT_PART_BYTES,
+        maximum_parts: int=SNAPSHOT_UPLOADED_PARTS,
+    ):
+        self._s3_client = s3_client
+        self._key = key
+        self._loop = loop
+        self._part_bytes = part_bytes
+        self._maximum_parts = maximum_parts
+
+        self._buffer = bytearray()
+        self._creation = None
+        self._parts = []
+
+    def _run(
+        self,
+        method: Any,
+        **parameters
+    ) -> asyncio.Future:
+        '''
+        Runs the given S3 client method in a thread,
+        for the uploaded object.
+        '''
+        return self._loop.run_in_executor(
+            None,
+            partial(
+                method,
+                Bucket=S3_BUCKET_NAME,
+                Key=self._key,
+                **parameters
+            ),
+        )
+
+    async def _upload_part(
+        self,
+        part_number: int,
+        body: bytes,
+    ) -> dict:
+        '''
+        Coroutine that uploads one part, returns its number and its ETag.
+        '''
+        upload = await self._creation
+
+        response = await self._run(
+            self._s3_client.upload_part,
+            UploadId=upload['UploadId'],
+            PartNumber=part_number,
+            Body=body,
+        )
+
+        return {
+            'PartNumber': part_number,
+            'ETag': response['ETag'],
+        }
+
+    def _start_part(self):
+        '''
+        Starts to upload the buffered bytes as the next part.
+        '''
+        if self._creation is None:
+            self._creation = self._run(
+                self._s3_client.create_multipart_upload,
+            )
+
+        self._parts.append(
+            asyncio.ensure_future(
+                self._upload_part(
+                    len(self._parts) + 1,
+                    bytes(self._buffer),
                 ),
-                json={
-                    'scroll': ELASTICSEARCH_SEARCH_CONTEXT_LIFETIME,
-                    'scroll_id': scroll_id
-                }
-            ) as response:
-                return await response.json()
+                loop=self._loop,
+            )
+        )
+        del self._buffer[:]
+
+    def write(self, data: bytes):
+        '''
+        Adds the given data at the end of the object.
+        '''
+        self._buffer += data
+
+        if len(self._buffer) >= self._part_bytes:
+            self._start_part()
+
+    async def drain(self):
+        '''
+        Coroutine that waits for the parts being uploaded
+        to be less than the maximum.
+        '''
+        uploading = [part for part in self._parts if not part.done()]
+
+        while len(uploading) > self._maximum_parts:
+            _, pending = await asyncio.wait(
+                uploading,
+                loop=self._loop,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            uploading = list(pending)
+
+    async def close(self):
+        '''
+        Coroutine that uploads the end of the object
+        and waits for the whole object to be uploaded.
+        '''
+        if self._creation is None:
+            await self._run(
+                self._s3_client.put_object,
+                Body=bytes(self._buffer),
+            )
+            return
+
+        if self._buffer:
+            self._start_part()
+
+        parts = await asyncio.gather(
+            *self._parts,
+            loop=self._loop
+        )
+        upload = await self._creation
+
+        await self._run(
+            self._s3_client.complete_multipart_upload,
+            UploadId=upload['UploadId'],
+            MultipartUpload={'Parts': parts},
+        )
+
+    async def abort(self):
+        '''
+        Coroutine that stops the upload and removes the uploaded parts.
+        '''
+        for part in self._parts:
+            part.cancel()
 
+        if self._creation is None:
+            return
 
-async def _generate_snapshot(index_name: str):
+        upload = await self._creation
+
+        await self._run(
+            self._s3_client.abort_multipart_upload,
+            UploadId=upload['UploadId'],
+        )
+
+
+_Archive = namedtuple(
+    '_Archive',
+    (
+        'key',
+        'upload',
+        'writer',
+    ),
+)
+
+
+class _SnapshotWriter:
     '''
-    Stream one index content from ES
-    and stores it into a file for upload
+    Writes the logs of one index into archives uploaded while they are written;
+    every slice of the index is sorted by date and written into its archives:
+    one archive for the day, or partitions (one archive per hour and/or
+    per slice) listed by the index of the day.
     '''
-    result = await _get_logs_from_elasticsearch(index_name)
 
-    scroll_id = result['_scroll_id']
-    logs = result['hits']['hits']
-    elasticsearch_logs_amount = len(logs)
+    def __init__(
+        self,
+        s3_client: Any,
+        index_name: str,
+        loop: asyncio.AbstractEventLoop,
+        partition: str=ARCHIVE_PARTITION,
+        slices: int=SNAPSHOT_SLICES,
+    ):
+        self._s3_client = s3_client
+        self._index_name = index_name
+        self._loop = loop
+        self._partition = partition
+        self._slices = slices
+        self._partitioned = partition == 'hour' or slices > 1
+
+        # current archive of every slice
+        self._archives = {}
+        self._partitions = []
+
+    def _get_key(
+        self,
+        slice_id: int,
+        log: Any,
+    ) -> str:
+        '''
+        Returns the key of the archive of the given log.
+        '''
+        if not self._partitioned:
+            return self._index_name
+
+        names = [self._index_name]
+
+        if self._partition == 'hour':
+            names.append(log['_source']['date'][HOUR_START:HOUR_END])
+
+        if self._slices > 1:
+            names.append(str(slice_id))
+
+        return PARTITION_KEY_SEPARATOR.join(names)
+
+    async def _put(
+        self,
+        key: str,
+        body: str,
+    ):
+        '''
+        Coroutine that uploads the given small object.
+        '''
+        await self._loop.run_in_executor(
+            None,
+            partial(
+                self._s3_client.put_object,
+                Bucket=S3_BUCKET_NAME,
+                Key=key,
+                Body=body.encode(),
+            ),
+        )
 
-    with open(
-        '{}/{}'.format(
-            SNAPSHOTS_DIRECTORY,
-            index_name,
-        ),
-        LOGS_FILES_OPEN_METHOD,
-    ) as logs_file:
+    async def start(self):
+        '''
+        Coroutine that removes the index of a previous upload of the day,
+        it would be wrong (an index never refers to another archive,
+        so every archive is uploaded before its index).
+        '''
+        await self._loop.run_in_executor(
+            None,
+            partial(
+                self._s3_client.delete_object,
+                Bucket=S3_BUCKET_NAME,
+                Key=self._index_name + ARCHIVE_INDEX_SUFFIX,
+            ),
+        )
+
+    def _open_archive(
+        self,
+        slice_id: int,
+        key: str,
+    ) -> _Archive:
+        '''
+        Starts to upload the given archive key for the given slice.
+        '''
+        upload = _MultipartUpload(
+            self._s3_client,
+            key,
+            self._loop,
+        )
+        archive = _Archive(
+            key,
+            upload,
+            _ArchiveWriter(upload),
+        )
+        self._archives[slice_id] = archive
+
+        return archive
+
+    async def _close_archive(
+        self,
+        slice_id: int,
+    ):
+        '''
+        Coroutine that ends the upload of the current archive
+        of the given slice, then uploads its index.
+        '''
+        archive = self._archives.pop(slice_id)
+
+        archive.writer.close()
+        await archive.upload.close()
+
+        await self._put(
+            archive.key + ARCHIVE_INDEX_SUFFIX,
+            archive.writer.get_index(),
+        )
+
+        if self._partitioned:
+            self._partitions.append(
+                archive.writer.get_dates_range() + [archive.key]
+            )
+
+    async def write(
+        self,
+        slice_id: int,
+        logs: list,
+    ):
+        '''
+        Coroutine that writes the given logs of the given slice
+        into their archives, waits for the uploads
+        if too many parts are being uploaded.
+        '''
+        archive = self._archives.get(slice_id)
 
         for log in logs:
-            logs_file.write(_get_log_to_string(log))
+            key = self._get_key(slice_id, log)
 
-        while elasticsearch_logs_amount > 0:
-            result = await _scroll_logs_from_elasticsearch(scroll_id)
+            if archive is None or key != archive.key:
+                if archive is not None:
+                    await self._close_archive(slice_id)
 
-            scroll_id = result['_scroll_id']
-            logs = result['hits']['hits']
+                archive = self._open_archive(slice_id, key)
+
+            archive.writer.write(log)
+
+        if archive is not None:
+            await archive.upload.drain()
+
+    async def close(self):
+        '''
+        Coroutine that ends the upload of the last archives,
+        then uploads the index of the day if the archive is partitioned.
+        '''
+        for slice_id in list(self._archives):
+            await self._close_archive(slice_id)
 
-            for log in logs:
-                logs_file.write(_get_log_to_string(log))
+        if self._partitioned:
+            # the partitions of one hour are listed before the next hour
+            self._partitions.sort()
 
-            elasticsearch_logs_amount = len(logs)
+            await self._put(
+                self._index_name + ARCHIVE_INDEX_SUFFIX,
+                json.dumps({'partitions': self._partitions}),
+            )
 
+    async def abort(self):
+        '''
+        Coroutine that stops the upload of the current archives.
+        '''
+        for archive in self._archives.values():
+            await archive.upload.abort()
 
-def _handle_snapshot(
-    s3_transfer: S3Transfer,
+
+def _get_hits(result: dict) -> list:
+    '''
+    Returns the logs of the given ES page
+    (the filtered response has no hits if the page is empty).
+    '''
+    return result.get('hits', {}).get('hits', [])
+
+
+async def _get_logs_from_elasticsearch(
+    session: aiohttp.ClientSession,
+    index_name: str,
+    slice_id: int,
+) -> dict:
+    '''
+    Opens a scroll on the given slice of the given index,
+    sorted by date, and returns its first page.
+    '''
+    query = {
+        'size': SNAPSHOT_PAGE_SIZE,
+        # archives are sorted by date,
+        # so the blocks of the archive cover short dates ranges
+        'sort': [
+            {'date': 'asc'},
+        ],
+    }
+
+    if SNAPSHOT_SLICES > 1:
+        query['slice'] = {
+            'id': slice_id,
+            'max': SNAPSHOT_SLICES,
+        }
+
+    with async_timeout.timeout(ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS):
+        async with session.post(
+            'http://{}:{}/{}/_search'.format(
+                ELASTICSEARCH_HOSTNAME,
+                ELASTICSEARCH_PORT,
+                index_name,
+            ),
+            params={
+                'scroll': ELASTICSEARCH_SEARCH_CONTEXT_LIFETIME,
+                'filter_path': ELASTICSEARCH_FILTER_PATH,
+            },
+            json=query,
+        ) as response:
+            response.raise_for_status()
+            return await response.json()
+
+
+async def _scroll_logs_from_elasticsearch(
+    session: aiohttp.ClientSession,
+    scroll_id: str,
+) -> dict:
+    '''
+    Scroll the next page of found results from Elasticsearch.
+    '''
+    # the scroll requests are POST requests, as GET requests with a body
+    # sent over a reused connection seemed not to return all the logs
+    with async_timeout.timeout(ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS):
+        async with session.post(
+            'http://{}:{}/_search/scroll'.format(
+                ELASTICSEARCH_HOSTNAME,
+                ELASTICSEARCH_PORT,
+            ),
+            params={
+                'filter_path': ELASTICSEARCH_FILTER_PATH,
+            },
+            json={
+                'scroll': ELASTICSEARCH_SEARCH_CONTEXT_LIFETIME,
+                'scroll_id': scroll_id
+            }
+        ) as response:
+            response.raise_for_status()
+            return await response.json()
+
+
+async def _clear_scroll(
+    session: aiohttp.ClientSession,
+    scroll_id: str,
+):
+    '''
+    Releases the search context of the given scroll
+    without waiting for its expiration.
+    '''
+    with async_timeout.timeout(ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS):
+        async with session.delete(
+            'http://{}:{}/_search/scroll'.format(
+                ELASTICSEARCH_HOSTNAME,
+                ELASTICSEARCH_PORT,
+            ),
+            json={
+                'scroll_id': [scroll_id],
+            }
+        ):
+            pass
+
+
+async def _export_slice(
+    session: aiohttp.ClientSession,
     index_name: str,
+    slice_id: int,
+    snapshot_writer: _SnapshotWriter,
+    rate_limiter: _RateLimiter,
 ):
     '''
-    Uploads the dump for the given index into S3
-    and remove the logs file.
+    Stream one slice of one index content from ES into its archives.
     '''
-    file_path = SNAPSHOTS_DIRECTORY + '/' + index_name
+    await rate_limiter.wait()
+    result = await _get_logs_from_elasticsearch(
+        session,
+        index_name,
+        slice_id,
+    )
+
+    scroll_id = result['_scroll_id']
+    logs = _get_hits(result)
+
+    try:
+        while logs:
+            await snapshot_writer.write(slice_id, logs)
+
+            await rate_limiter.wait()
+            result = await _scroll_logs_from_elasticsearch(
+                session,
+                scroll_id,
+            )
+
+            scroll_id = result['_scroll_id']
+            logs = _get_hits(result)
+
+    finally:
+        await _clear_scroll(session, scroll_id)
 
-    s3_transfer.upload_file(
-        file_path,
-        S3_BUCKET_NAME,
+
+async def _generate_snapshot(
+    s3_client: Any,
+    session: aiohttp.ClientSession,
+    index_name: str,
+    loop: asyncio.AbstractEventLoop,
+    rate_limiter: _RateLimiter,
+):
+    '''
+    Stream one index content from ES, slice by slice at the same time,
+    and uploads it into S3 while it is exported, with its index
+    '''
+    snapshot_writer = _SnapshotWriter(
+        s3_client,
         index_name,
+        loop,
     )
+    await snapshot_writer.start()
+
+    slices = [
+        asyncio.ensure_future(
+            _export_slice(
+                session,
+                index_name,
+                slice_id,
+                snapshot_writer,
+                rate_limiter,
+            ),
+            loop=loop,
+        )
+        for slice_id in range(SNAPSHOT_SLICES)
+    ]
+
+    try:
+        await asyncio.gather(
+            *slices,
+            loop=loop
+        )
+        await snapshot_writer.close()
 
-    os.remove(file_path)
+    except Exception:
+        for slice_task in slices:
+            slice_task.cancel()
+
+        await snapshot_writer.abort()
+        raise
 
 
 def _remove_index(
@@ -190,10 +836,45 @@ def _remove_index(
     )
 
 
+async def _snapshot_index(
+    s3_client: Any,
+    session: aiohttp.ClientSession,
+    es_client: Elasticsearch,
+    index_name: str,
+    loop: asyncio.AbstractEventLoop,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: _RateLimiter,
+):
+    '''
+    Uploads the given index into S3 then removes its logs from ES,
+    once one of the indices being exported is done.
+    '''
+    async with semaphore:
+        await _generate_snapshot(
+            s3_client,
+            session,
+            index_name,
+            loop,
+            rate_limiter,
+        )
+        await loop.run_in_executor(
+            None,
+            _remove_index,
+            es_client,
+            index_name,
+        )
+
+
 async def _run():
     '''
     Main script.
     '''
+    loop = asyncio.get_event_loop()
+
+    # boto3 and the ES client are blocking, they are used in threads
+    loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=SNAPSHOT_THREADS)
+    )
 
     s3_client = boto3.client(
         's3',
@@ -201,24 +882,58 @@ async def _run():
         aws_secret_access_key=AWS_SECRET_KEY,
         # the custom endpoint is only required on dev environment
         endpoint_url='http://{}'.format(S3_ENDPOINT) if S3_ENDPOINT else None,
+        config=Config(max_pool_connections=SNAPSHOT_THREADS),
     )
-    s3_transfer = S3Transfer(s3_client)
 
-    es_client = Elasticsearch([ELASTICSEARCH_HOSTNAME])
+    es_client = Elasticsearch(
+        [ELASTICSEARCH_HOSTNAME],
+        maxsize=SNAPSHOT_INDICES,
+    )
 
     indices = _get_data_indices()
 
-    for index in indices:
-        await _generate_snapshot(index)
-        _handle_snapshot(
-            s3_transfer,
-            index,
-        )
-        _remove_index(
-            es_client,
-            index,
+    semaphore = asyncio.Semaphore(
+        SNAPSHOT_INDICES,
+        loop=loop,
+    )
+    rate_limiter = _RateLimiter(loop)
+
+    # one session for all the ES requests of the script,
+    # enough connections for all the slices exported at the same time
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=SNAPSHOT_INDICES * SNAPSHOT_SLICES,
+            loop=loop,
+        ),
+        loop=loop,
+    ) as session:
+
+        # an index failing does not stop the others
+        results = await asyncio.gather(
+            *[
+                _snapshot_index(
+                    s3_client,
+                    session,
+                    es_client,
+                    index,
+                    loop,
+                    semaphore,
+                    rate_limiter,
+                )
+                for index in indices
+            ],
+            loop=loop,
+            return_exceptions=True
         )
 
+    errors = [
+        result
+        for result in results
+        if isinstance(result, Exception)
+    ]
+    if errors:
+        raise errors[0]
+
 
 def main():
     '''
@@ -2,30 +2,153 @@
 Starts the service.
 '''
 
+import asyncio
 from functools import partial
+
+import aiohttp
 from aiohttp import web
-from elasticsearch import Elasticsearch
 
+import aiobotocore
+from aiobotocore.client import AioBaseClient
+from aiobotocore.config import AioConfig
+
+from logs.indices import IndicesCatalog
+from logs.ingest_buffer import IngestBuffer
+from logs.write_ahead_log import WriteAheadLog
 from logs.post_logs_handler import post_logs
 from logs.get_logs_handler import get_logs
+from logs.get_ingest_stats_handler import get_ingest_stats
 
-from logs.config import ELASTICSEARCH_HOSTNAME
+from logs.config import ELASTICSEARCH_MAXIMUM_CONNECTIONS
+from logs.config import ELASTICSEARCH_KEEPALIVE_SECONDS
+from logs.config import S3_ENDPOINT
+from logs.config import S3_MAXIMUM_CONNECTIONS
+from logs.config import S3_KEEPALIVE_SECONDS
 from logs.config import AIOHTTP_PORT
+from logs.config import INGEST_WAL_DIRECTORY
+
+
+async def _close_session(
+    app: web.Application,
+    session: aiohttp.ClientSession,
+):
+    '''
+    Closes the given HTTP session when the application stops.
+    '''
+    await session.close()
+
+
+async def _close_s3_client(
+    app: web.Application,
+    s3_client: AioBaseClient,
+):
+    '''
+    Closes the connections of the given S3 client when the application stops.
+    '''
+    await s3_client.close()
+
+
+async def _start_ingest_buffer(
+    app: web.Application,
+    ingest_buffer: IngestBuffer,
+):
+    '''
+    Starts the periodic flush of the ingest buffer.
+    '''
+    ingest_buffer.start()
+
+
+async def _close_ingest_buffer(
+    app: web.Application,
+    ingest_buffer: IngestBuffer,
+):
+    '''
+    Flushes the queued logs before the application stops.
+    '''
+    await ingest_buffer.close()
 
 
 def main():
     '''
     Service starting function.
     '''
-    app = web.Application()
+    loop = asyncio.get_event_loop()
+    app = web.Application(loop=loop)
+
+    # one pooled session for all the ES requests of the worker,
+    # so search, scroll and bulk requests reuse opened connections
+    es_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=ELASTICSEARCH_MAXIMUM_CONNECTIONS,
+            keepalive_timeout=ELASTICSEARCH_KEEPALIVE_SECONDS,
+            loop=loop,
+        ),
+        loop=loop,
+    )
+    app.on_cleanup.append(
+        partial(
+            _close_session,
+            session=es_session,
+        )
+    )
 
-    es_client = Elasticsearch(hosts=[ELASTICSEARCH_HOSTNAME],)
+    # one S3 client for all the GET requests of the worker,
+    # so credentials and endpoint are resolved once and connections are reused;
+    # without endpoint (production), the default AWS endpoint is used
+    s3_client = aiobotocore.get_session(loop=loop).create_client(
+        service_name='s3',
+        region_name='',
+        aws_secret_access_key='',
+        aws_access_key_id='',
+        endpoint_url='http://{}'.format(S3_ENDPOINT) if S3_ENDPOINT else None,
+        config=AioConfig(
+            max_pool_connections=S3_MAXIMUM_CONNECTIONS,
+            connector_args={
+                'keepalive_timeout': S3_KEEPALIVE_SECONDS,
+            },
+        ),
+    )
+    app.on_cleanup.append(
+        partial(
+            _close_s3_client,
+            s3_client=s3_client,
+        )
+    )
+
+    write_ahead_log = None
+    if INGEST_WAL_DIRECTORY:
+        # every worker needs its own directory as segments are not shared
+        write_ahead_log = WriteAheadLog(
+            '{}/{}'.format(
+                INGEST_WAL_DIRECTORY,
+                AIOHTTP_PORT,
+            ),
+            loop,
+        )
+
+    ingest_buffer = IngestBuffer(
+        es_session,
+        loop,
+        write_ahead_log=write_ahead_log,
+    )
+    app.on_startup.append(
+        partial(
+            _start_ingest_buffer,
+            ingest_buffer=ingest_buffer,
+        )
+    )
+    app.on_shutdown.append(
+        partial(
+            _close_ingest_buffer,
+            ingest_buffer=ingest_buffer,
+        )
+    )
 
     app.router.add_post(
         '/api/1/service/{id}/logs',
         partial(
             post_logs,
-            es_client=es_client,
+            ingest_buffer=ingest_buffer,
         )
     )
 
@@ -33,7 +156,20 @@ def main():
         '/api/1/service/{id}/logs/{start}/{end}',
         partial(
             get_logs,
-            es_client=es_client,
+            es_session=es_session,
+            indices_catalog=IndicesCatalog(
+                es_session,
+                loop,
+            ),
+            s3_client=s3_client,
+        )
+    )
+
+    app.router.add_get(
+        '/api/1/ingest/stats',
+        partial(
+            get_ingest_stats,
+            ingest_buffer=ingest_buffer,
         )
     )
 
@@ -0,0 +1,512 @@
+'''
+Fetches the daily archives of the logs from S3,
+several days at once but in chronological order.
+'''
+import asyncio
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import botocore
+from aiobotocore.client import AioBaseClient
+
+from logs.config import S3_BUCKET_NAME
+from logs.config import S3_MAXIMUM_FETCHED_ARCHIVES
+from logs.config import S3_MAXIMUM_BUFFERED_BYTES
+
+S3_READ_CHUNK_BYTES = 1024 * 1024
+
+# marks the end of one archive into its queue
+ARCHIVE_END = None
+
+# compressed archives are made of independent frames (one per block),
+# archives starting with none of these magic numbers are plain text
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+MAGIC_LENGTH = len(ZSTD_MAGIC)
+
+# the index of an archive lists its blocks of lines with their dates range,
+# as [first date, last date, offset, length], in the order of the archive;
+# the index of a day partitioned by hour lists its partitions instead,
+# as [first date, last date, key] (data-{id}-YYYY-MM-DD/HH)
+ARCHIVE_INDEX_SUFFIX = '.index'
+ARCHIVE_PARTITIONS = 'partitions'
+
+# archived logs are written with the default separators of json.dumps,
+# their date first, so a date nested into a field cannot be matched;
+# lines of the archives written before start with another field,
+# their date is the first one found in the line
+DATE_PREFIX = b'{"date": "'
+DATE_KEY = b'"date": "'
+DATE_END = b'"'
+
+
+def _get_date(line: bytes) -> bytes:
+    '''
+    Returns the ISO date of the given archived log line,
+    None if the line has no date.
+    '''
+    if line.startswith(DATE_PREFIX):
+        start = len(DATE_PREFIX)
+    else:
+        start = line.find(DATE_KEY)
+        if start == -1:
+            return None
+
+        start += len(DATE_KEY)
+
+    return line[start:line.find(DATE_END, start)]
+
+
+def get_lines_in_range(
+    chunk: bytes,
+    start_date: bytes,
+    end_date: bytes,
+) -> list:
+    '''
+    Returns the lines of the given chunk with a date
+    between the given ISO dates (included), as they are in the archive.
+
+    ISO dates of the same format are sorted like their strings,
+    so lines are filtered without being decoded.
+    '''
+    lines = []
+
+    for line in chunk.splitlines():
+        date = _get_date(line)
+
+        if date is not None and start_date <= date <= end_date:
+            lines.append(line)
+
+    return lines
+
+
+class ArchiveError(Exception):
+    '''
+    Raised when an archive cannot be decompressed.
+    '''
+
+
+class _ArchiveDecompressor:
+    '''
+    Decompresses an archive (or a range of frames of an archive)
+    while it is got from S3, frame after frame;
+    plain text archives are returned as they are.
+    '''
+
+    def __init__(self):
+        self._plain = None
+        self._decompressor = None
+        self._pending = b''
+
+    def _start_frame(self, data: bytes):
+        '''
+        Creates the decompressor of the frame starting the given data.
+        '''
+        if data.startswith(GZIP_MAGIC):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif data.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise ArchiveError('zstandard is required to read the archive')
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            raise ArchiveError('unexpected data between archive frames')
+
+    def decompress(self, data: bytes) -> bytes:
+        '''
+        Returns the decompressed content of the given data,
+        what follows the data read before.
+        '''
+        if self._plain:
+            return data
+
+        data = self._pending + data
+        self._pending = b''
+
+        if self._plain is None:
+            # the first bytes tell if the archive is compressed
+            if len(data) < MAGIC_LENGTH:
+                self._pending = data
+                return b''
+
+            self._plain = not (
+                data.startswith(GZIP_MAGIC) or
+                data.startswith(ZSTD_MAGIC)
+            )
+            if self._plain:
+                return data
+
+        output = []
+
+        while data:
+            if self._decompressor is None:
+                # the magic number of the next frame may be cut
+                if len(data) < MAGIC_LENGTH:
+                    self._pending = data
+                    break
+
+                self._start_frame(data)
+
+            output.append(self._decompressor.decompress(data))
+
+            if self._decompressor.eof:
+                data = self._decompressor.unused_data
+                self._decompressor = None
+            else:
+                data = b''
+
+        return b''.join(output)
+
+    def flush(self) -> bytes:
+        '''
+        Returns the end of the archive, raises ArchiveError
+        if the last frame is truncated.
+        '''
+        if self._plain is None:
+            return self._pending
+
+        if self._decompressor is not None or self._pending:
+            raise ArchiveError('truncated archive frame')
+
+        return b''
+
+
+def get_archive_ranges(
+    index: dict,
+    start_date: str,
+    end_date: str,
+) -> list:
+    '''
+    Returns the bytes ranges (first and last bytes included)
+    of the blocks of an archive overlapping the given ISO dates range;
+    contiguous blocks are merged in order to send less requests.
+    '''
+    ranges = []
+
+    for first_date, last_date, offset, length in index['blocks']:
+        if last_date < start_date or first_date > end_date:
+            continue
+
+        if ranges and ranges[-1][1] + 1 == offset:
+            ranges[-1][1] = offset + length - 1
+        else:
+            ranges.append([offset, offset + length - 1])
+
+    return ranges
+
+
+def get_archive_partitions(
+    index: dict,
+    start_date: str,
+    end_date: str,
+) -> list:
+    '''
+    Returns the keys of the partitions of an archive
+    overlapping the given ISO dates range.
+    '''
+    return [
+        key
+        for first_date, last_date, key in index[ARCHIVE_PARTITIONS]
+        if last_date >= start_date and first_date <= end_date
+    ]
+
+
+class ArchivesFetcher:
+    '''
+    Gets the given archives from S3 in background tasks
+    and returns their content chunk by chunk, archive after archive.
+
+    At most the given amount of archives are fetched at the same time,
+    including the archive being read, and they stop reading S3
+    when the buffered bytes reach the given maximum: the archive being read
+    has its own share of the buffer, so it cannot be blocked
+    by the archives fetched ahead, which share the rest of the buffer.
+
+    When an archive has an index, only the blocks of the archive
+    overlapping the given ISO dates range are got, using ranged requests;
+    only the overlapping partitions of a partitioned archive are got.
+    Compressed archives are decompressed while they are got.
+
+    Chunks only contain complete lines. Missing archives are ignored.
+    '''
+
+    def __init__(
+        self,
+        s3_client: AioBaseClient,
+        keys: list,
+        start_date: str,
+        end_date: str,
+        loop: asyncio.AbstractEventLoop,
+        maximum_archives: int=S3_MAXIMUM_FETCHED_ARCHIVES,
+        maximum_bytes: int=S3_MAXIMUM_BUFFERED_BYTES,
+    ):
+        self._s3_client = s3_client
+        self._keys = keys
+        self._start_date = start_date
+        self._end_date = end_date
+        self._loop = loop
+        self._maximum_archives = maximum_archives
+        self._maximum_bytes = maximum_bytes
+
+        # bytes of the buffer always available for the archive being read
+        self._reserved_bytes = maximum_bytes // maximum_archives
+
+        self._queues = []
+        self._tasks = []
+        self._position = 0
+        self._buffered_bytes = 0
+        self._archives_bytes = []
+        self._buffer_released = asyncio.Condition(loop=loop)
+
+    def _start_next_archive(self):
+        '''
+        Starts to fetch the next archive, if any.
+        '''
+        position = len(self._queues)
+        if position == len(self._keys):
+            return
+
+        queue = asyncio.Queue(loop=self._loop)
+        self._queues.append(queue)
+        self._archives_bytes.append(0)
+        self._tasks.append(
+            asyncio.ensure_future(
+                self._fetch_archive(
+                    position,
+                    queue,
+                ),
+                loop=self._loop,
+            )
+        )
+
+    def start(self):
+        '''
+        Starts to fetch the first archives.
+        '''
+        for _ in range(self._maximum_archives):
+            self._start_next_archive()
+
+    def _is_buffer_full(
+        self,
+        position: int,
+        size: int,
+    ) -> bool:
+        '''
+        Indicates if the given archive has to wait for buffered chunks
+        to be read before buffering the given amount of bytes.
+        '''
+        archive_bytes = self._archives_bytes[position]
+
+        if position == self._position:
+            # one chunk is always accepted, even larger than the share
+            return (
+                archive_bytes != 0 and
+                archive_bytes + size > self._reserved_bytes
+            )
+
+        ahead_bytes = (
+            self._buffered_bytes -
+            self._archives_bytes[self._position]
+        )
+        return (
+            ahead_bytes + size >
+            self._maximum_bytes - self._reserved_bytes
+        )
+
+    async def _put_chunk(
+        self,
+        position: int,
+        queue: asyncio.Queue,
+        chunk: bytes,
+    ):
+        '''
+        Coroutine that buffers the given chunk of the given archive,
+        waits for buffered chunks to be read first if the buffer is full.
+        '''
+        async with self._buffer_released:
+            while self._is_buffer_full(position, len(chunk)):
+                await self._buffer_released.wait()
+
+            self._buffered_bytes += len(chunk)
+            self._archives_bytes[position] += len(chunk)
+
+        queue.put_nowait(chunk)
+
+    async def _get_ranges(
+        self,
+        key: str,
+    ) -> list:
+        '''
+        Coroutine that returns the archives keys and bytes ranges to get
+        for the given archive, in chronological order;
+        one None range (the whole archive) if the archive has no index,
+        the ranges of its partitions overlapping the dates range
+        if the archive is partitioned.
+        '''
+        try:
+            response = await self._s3_client.get_object(
+                Bucket=S3_BUCKET_NAME,
+                Key=key + ARCHIVE_INDEX_SUFFIX,
+            )
+        except botocore.exceptions.ClientError:
+            # archives created before the indices
+            return [(key, None)]
+
+        body = response['Body']
+
+        try:
+            index = json.loads((await body.read()).decode())
+        finally:
+            body.close()
+
+        if ARCHIVE_PARTITIONS in index:
+            partitions_ranges = await asyncio.gather(
+                *[
+                    self._get_ranges(partition_key)
+                    for partition_key in get_archive_partitions(
+                        index,
+                        self._start_date,
+                        self._end_date,
+                    )
+                ],
+                loop=self._loop,
+            )
+
+            return [
+                key_range
+                for partition_ranges in partitions_ranges
+                for key_range in partition_ranges
+            ]
+
+        return [
+            (key, byte_range)
+            for byte_range in get_archive_ranges(
+                index,
+                self._start_date,
+                self._end_date,
+            )
+        ]
+
+    async def _read_archive(
+        self,
+        position: int,
+        queue: asyncio.Queue,
+        key: str,
+        byte_range: list,
+    ):
+        '''
+        Coroutine that puts the chunks of the given bytes range
+        of the given archive into its queue (all the archive if no range).
+        '''
+        parameters = {
+            'Bucket': S3_BUCKET_NAME,
+            'Key': key,
+        }
+        if byte_range is not None:
+            parameters['Range'] = 'bytes={}-{}'.format(*byte_range)
+
+        try:
+            response = await self._s3_client.get_object(**parameters)
+        except botocore.exceptions.ClientError:
+            return
+
+        body = response['Body']
+        decompressor = _ArchiveDecompressor()
+
+        try:
+            remainder = b''
+            data = await body.read(S3_READ_CHUNK_BYTES)
+
+            while data:
+                data = remainder + decompressor.decompress(data)
+                end = data.rfind(b'\n') + 1
+                remainder = data[end:]
+
+                if end:
+                    await self._put_chunk(position, queue, data[:end])
+
+                data = await body.read(S3_READ_CHUNK_BYTES)
+
+            remainder += decompressor.flush()
+            if remainder:
+                await self._put_chunk(position, queue, remainder)
+
+        finally:
+            body.close()
+
+    async def _fetch_archive(
+        self,
+        position: int,
+        queue: asyncio.Queue,
+    ):
+        '''
+        Coroutine that puts the chunks of the given archive into its queue,
+        followed by the archive end mark;
+        an error is put into the queue to be raised to the consumer.
+        '''
+        key = self._keys[position]
+
+        try:
+            for archive_key, byte_range in await self._get_ranges(key):
+                await self._read_archive(
+                    position,
+                    queue,
+                    archive_key,
+                    byte_range,
+                )
+
+            queue.put_nowait(ARCHIVE_END)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            queue.put_nowait(error)
+
+    async def _release(
+        self,
+        size: int,
+    ):
+        '''
+        Coroutine that frees the given bytes of the archive being read
+        and wakes up the archives waiting for buffer space.
+        '''
+        async with self._buffer_released:
+            self._buffered_bytes -= size
+            self._archives_bytes[self._position] -= size
+            self._buffer_released.notify_all()
+
+    async def next_chunk(self) -> bytes:
+        '''
+        Coroutine that returns the next chunk of lines,
+        an empty chunk when all the archives have been returned.
+        '''
+        while self._position < len(self._queues):
+            chunk = await self._queues[self._position].get()
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            if chunk is ARCHIVE_END:
+                # the next archive now gets the share of the archive being read
+                self._queues[self._position] = None
+                self._position += 1
+                self._start_next_archive()
+                if self._position < len(self._queues):
+                    await self._release(0)
+                continue
+
+            await self._release(len(chunk))
+            return chunk
+
+        return b''
+
+    def close(self):
+        '''
+        Stops fetching archives (if the client is gone for instance).
+        '''
+        for task in self._tasks:
+            task.cancel()
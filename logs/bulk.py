@@ -0,0 +1,198 @@
+'''
+Sends documents to the Elasticsearch bulk API without blocking the loop.
+'''
+import asyncio
+import random
+
+import aiohttp
+import async_timeout
+
+from logs.json_encoder import encode
+
+from logs.config import ELASTICSEARCH_HOSTNAME
+from logs.config import ELASTICSEARCH_PORT
+from logs.config import ELASTICSEARCH_BULK_TIMEOUT_SECONDS
+from logs.config import ELASTICSEARCH_BULK_MAXIMUM_ATTEMPTS
+from logs.config import ELASTICSEARCH_BULK_BACKOFF_SECONDS
+from logs.config import ELASTICSEARCH_BULK_MAXIMUM_BACKOFF_SECONDS
+
+BULK_CONTENT_TYPE = 'application/x-ndjson'
+LOGS_TYPE = 'logs'
+
+# statuses returned when ES is overloaded (thread pool queue full)
+# or unavailable, the same request may succeed later
+RETRY_STATUSES = (429, 502, 503, 504)
+UNAVAILABLE_STATUS = 503
+
+
+class BulkError(Exception):
+    '''
+    Raised when Elasticsearch refuses a whole bulk request,
+    arguments are the HTTP status and the response body.
+    '''
+
+
+def get_bulk_entries(
+    index: str,
+    logs: list,
+) -> list:
+    '''
+    Returns one NDJSON bulk entry (action line and source line)
+    per log of the given index; the entries are views
+    on one byte buffer written for the whole batch.
+    '''
+    action = encode(
+        {
+            'index': {
+                '_index': index,
+                '_type': LOGS_TYPE,
+            }
+        }
+    ) + b'\n'
+
+    # the buffer belongs to the batch, it is freed with its entries
+    buffer = bytearray()
+    ends = []
+
+    for log in logs:
+        buffer += action
+        buffer += encode(log)
+        buffer += b'\n'
+        ends.append(len(buffer))
+
+    data = memoryview(buffer)
+
+    entries = []
+    start = 0
+    for end in ends:
+        entries.append(data[start:end])
+        start = end
+
+    return entries
+
+
+def get_bulk_body(entries: list) -> bytes:
+    '''
+    Concatenates the given bulk entries into one bulk request body.
+    '''
+    return b''.join(entries)
+
+
+def _get_backoff_seconds(attempt: int) -> float:
+    '''
+    Returns the delay before the given retry attempt
+    (exponential backoff with full jitter).
+    '''
+    return random.uniform(
+        0,
+        min(
+            ELASTICSEARCH_BULK_MAXIMUM_BACKOFF_SECONDS,
+            ELASTICSEARCH_BULK_BACKOFF_SECONDS * 2 ** attempt,
+        ),
+    )
+
+
+async def _post_bulk(
+    session: aiohttp.ClientSession,
+    body: bytes,
+) -> list:
+    '''
+    Coroutine that sends the given bulk body to ES
+    and returns the result of every entry.
+    '''
+    with async_timeout.timeout(ELASTICSEARCH_BULK_TIMEOUT_SECONDS):
+        async with session.post(
+            'http://{}:{}/_bulk'.format(
+                ELASTICSEARCH_HOSTNAME,
+                ELASTICSEARCH_PORT,
+            ),
+            data=body,
+            headers={'Content-Type': BULK_CONTENT_TYPE},
+        ) as response:
+            status = response.status
+            result = await response.json()
+
+    if status != 200:
+        raise BulkError(status, result)
+
+    # every item contains one result, keyed by the action name
+    return [
+        next(iter(item.values()))
+        for item in result['items']
+    ]
+
+
+async def send_bulk(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    entries: list,
+) -> list:
+    '''
+    Coroutine that indexes the given bulk entries into ES
+    and returns the result (status and error) of every entry;
+    the given semaphore is held during every request,
+    not while waiting before the next attempt.
+
+    Only the entries rejected because ES is overloaded are sent again,
+    with exponential backoff; the whole request is sent again
+    if it failed entirely for the same reason or timed out,
+    so its entries ES already indexed are then indexed twice.
+    '''
+    results = [None] * len(entries)
+    pending = list(range(len(entries)))
+    error = None
+
+    for attempt in range(ELASTICSEARCH_BULK_MAXIMUM_ATTEMPTS):
+
+        if attempt > 0:
+            await asyncio.sleep(_get_backoff_seconds(attempt))
+
+        try:
+            async with semaphore:
+                items = await _post_bulk(
+                    session,
+                    get_bulk_body(
+                        [entries[position] for position in pending]
+                    ),
+                )
+        except BulkError as bulk_error:
+            if bulk_error.args[0] not in RETRY_STATUSES:
+                raise
+            error = bulk_error
+            continue
+        except (aiohttp.ClientError, asyncio.TimeoutError) as client_error:
+            error = client_error
+            continue
+
+        retried = []
+        for position, item in zip(pending, items):
+            results[position] = item
+            if item['status'] in RETRY_STATUSES:
+                retried.append(position)
+
+        pending = retried
+        if not pending:
+            break
+
+    for position in pending:
+        if results[position] is None:
+            results[position] = {
+                'status': UNAVAILABLE_STATUS,
+                'error': repr(error),
+            }
+
+    return results
+
+
+def is_failure(result: dict) -> bool:
+    '''
+    Indicates if the given entry result is an indexing failure.
+    '''
+    return result['status'] >= 300
+
+
+def is_retryable(result: dict) -> bool:
+    '''
+    Indicates if the given failed entry can be sent again later.
+    '''
+    return result['status'] in RETRY_STATUSES
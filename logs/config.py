@@ -15,3 +15,135 @@ assert AIOHTTP_PORT is not None
 
 S3_ENDPOINT = os.getenv('S3_ENDPOINT')
 S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
+
+# pool of keep-alive connections to Elasticsearch shared by all the requests
+# of one worker (search, scroll and bulk)
+ELASTICSEARCH_MAXIMUM_CONNECTIONS = int(
+    os.getenv('ELASTICSEARCH_MAXIMUM_CONNECTIONS', 50)
+)
+ELASTICSEARCH_KEEPALIVE_SECONDS = float(
+    os.getenv('ELASTICSEARCH_KEEPALIVE_SECONDS', 60)
+)
+
+# maximum amount of simultaneous bulk requests of one worker,
+# so ingestion never takes all the connections of the pool
+ELASTICSEARCH_BULK_MAXIMUM_CONNECTIONS = int(
+    os.getenv('ELASTICSEARCH_BULK_MAXIMUM_CONNECTIONS', 10)
+)
+ELASTICSEARCH_BULK_TIMEOUT_SECONDS = int(
+    os.getenv('ELASTICSEARCH_BULK_TIMEOUT_SECONDS', 30)
+)
+
+# the ingest buffer flushes the logs of many POST requests together
+# as soon as one of these thresholds is reached
+INGEST_BUFFER_MAXIMUM_LOGS = int(
+    os.getenv('INGEST_BUFFER_MAXIMUM_LOGS', 5000)
+)
+INGEST_BUFFER_MAXIMUM_BYTES = int(
+    os.getenv('INGEST_BUFFER_MAXIMUM_BYTES', 5 * 1024 * 1024)
+)
+INGEST_BUFFER_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv('INGEST_BUFFER_FLUSH_INTERVAL_SECONDS', 0.2)
+)
+
+# POST bodies larger than this size are rejected
+INGEST_MAXIMUM_BODY_BYTES = int(
+    os.getenv('INGEST_MAXIMUM_BODY_BYTES', 64 * 1024 * 1024)
+)
+
+# POST requests are refused with 429 when the logs waiting to be indexed
+# exceed these sizes, globally or for the requesting service
+INGEST_MAXIMUM_PENDING_BYTES = int(
+    os.getenv('INGEST_MAXIMUM_PENDING_BYTES', 256 * 1024 * 1024)
+)
+INGEST_MAXIMUM_PENDING_BYTES_PER_SERVICE = int(
+    os.getenv('INGEST_MAXIMUM_PENDING_BYTES_PER_SERVICE', 64 * 1024 * 1024)
+)
+INGEST_RETRY_AFTER_SECONDS = int(
+    os.getenv('INGEST_RETRY_AFTER_SECONDS', 1)
+)
+
+# when a directory is set, POST logs are appended to a local write-ahead log
+# and replayed into Elasticsearch from there (fsync policy: always,
+# interval (when a segment is sealed) or never)
+INGEST_WAL_DIRECTORY = os.getenv('INGEST_WAL_DIRECTORY')
+INGEST_WAL_SEGMENT_BYTES = int(
+    os.getenv('INGEST_WAL_SEGMENT_BYTES', 16 * 1024 * 1024)
+)
+INGEST_WAL_SEGMENT_SECONDS = float(
+    os.getenv('INGEST_WAL_SEGMENT_SECONDS', 1)
+)
+INGEST_WAL_FSYNC_POLICY = os.getenv('INGEST_WAL_FSYNC_POLICY', 'interval')
+INGEST_WAL_RETRY_SECONDS = float(
+    os.getenv('INGEST_WAL_RETRY_SECONDS', 5)
+)
+# bulk requests of the write-ahead log refused entirely by ES
+# are sent again up to this amount of times, then their logs are dropped
+INGEST_WAL_MAXIMUM_ATTEMPTS = int(
+    os.getenv('INGEST_WAL_MAXIMUM_ATTEMPTS', 5)
+)
+
+# entries rejected by ES because it is overloaded are sent again
+# with an exponential backoff starting at this delay
+ELASTICSEARCH_BULK_MAXIMUM_ATTEMPTS = int(
+    os.getenv('ELASTICSEARCH_BULK_MAXIMUM_ATTEMPTS', 5)
+)
+ELASTICSEARCH_BULK_BACKOFF_SECONDS = float(
+    os.getenv('ELASTICSEARCH_BULK_BACKOFF_SECONDS', 0.1)
+)
+ELASTICSEARCH_BULK_MAXIMUM_BACKOFF_SECONDS = float(
+    os.getenv('ELASTICSEARCH_BULK_MAXIMUM_BACKOFF_SECONDS', 5)
+)
+
+# logs are got from Elasticsearch by pages, the size of the first page
+# is then adapted to the logs size in order to get pages of the given bytes
+ELASTICSEARCH_PAGE_SIZE = int(
+    os.getenv('ELASTICSEARCH_PAGE_SIZE', 1000)
+)
+ELASTICSEARCH_MINIMUM_PAGE_SIZE = int(
+    os.getenv('ELASTICSEARCH_MINIMUM_PAGE_SIZE', 100)
+)
+ELASTICSEARCH_MAXIMUM_PAGE_SIZE = int(
+    os.getenv('ELASTICSEARCH_MAXIMUM_PAGE_SIZE', 10000)
+)
+ELASTICSEARCH_PAGE_BYTES = int(
+    os.getenv('ELASTICSEARCH_PAGE_BYTES', 2 * 1024 * 1024)
+)
+# amount of pages fetched from Elasticsearch ahead of the page being sent
+ELASTICSEARCH_PREFETCHED_PAGES = int(
+    os.getenv('ELASTICSEARCH_PREFETCHED_PAGES', 2)
+)
+
+# a streamed response waits for the client every time this amount of bytes
+# is written, and fails if the client does not receive them before the timeout
+RESPONSE_HIGH_WATER_BYTES = int(
+    os.getenv('RESPONSE_HIGH_WATER_BYTES', 256 * 1024)
+)
+RESPONSE_WRITE_TIMEOUT_SECONDS = float(
+    os.getenv('RESPONSE_WRITE_TIMEOUT_SECONDS', 30)
+)
+
+# GET logs requests only search the existing daily indices of the range,
+# the list of the existing indices is got again after this delay
+ELASTICSEARCH_INDICES_CATALOG_SECONDS = float(
+    os.getenv('ELASTICSEARCH_INDICES_CATALOG_SECONDS', 60)
+)
+
+# archived days of a GET logs request are got from S3 at the same time
+# up to this amount of days, and up to this amount of bytes not sent yet
+# (the day being sent keeps its share of these bytes)
+S3_MAXIMUM_FETCHED_ARCHIVES = int(
+    os.getenv('S3_MAXIMUM_FETCHED_ARCHIVES', 4)
+)
+S3_MAXIMUM_BUFFERED_BYTES = int(
+    os.getenv('S3_MAXIMUM_BUFFERED_BYTES', 16 * 1024 * 1024)
+)
+
+# size of the pool of connections to S3 shared by all the GET requests
+# of one worker, and time an idle connection to S3 is kept opened
+S3_MAXIMUM_CONNECTIONS = int(
+    os.getenv('S3_MAXIMUM_CONNECTIONS', 50)
+)
+S3_KEEPALIVE_SECONDS = float(
+    os.getenv('S3_KEEPALIVE_SECONDS', 12)
+)
@@ -0,0 +1,16 @@
+'''
+Handles GET /ingest/stats requests.
+'''
+from aiohttp import web
+
+from logs.ingest_buffer import IngestBuffer
+
+
+async def get_ingest_stats(
+    request: web.Request,
+    ingest_buffer: IngestBuffer,
+):
+    '''
+    Sends back the amounts of pending and shed logs of the worker.
+    '''
+    return web.json_response(ingest_buffer.get_stats())
@@ -1,130 +1,50 @@
 '''
 Handles GET /logs requests.
 '''
-import json
-import async_timeout
 from datetime import datetime, timedelta
-from typing import Any
 
-import botocore
-import aiobotocore
+from aiobotocore.client import AioBaseClient
 
 import aiohttp
 from aiohttp import web
-from elasticsearch import Elasticsearch
 
-from logs.config import S3_ENDPOINT
-from logs.config import S3_BUCKET_NAME
-from logs.config import ELASTICSEARCH_HOSTNAME
-from logs.config import ELASTICSEARCH_PORT
+from logs.archives import ArchivesFetcher
+from logs.archives import get_lines_in_range
+from logs.indices import IndicesCatalog
+from logs.indices import get_range_indices
+from logs.json_encoder import encode
+from logs.pagination import LogsPaginator
+from logs.pagination import PagesPrefetcher
+from logs.response_writer import ResponseWriter
 
 API_DATE_FORMAT = '%Y-%m-%d-%H-%M-%S'
-ELASTICSEARCH_DATE_FORMAT = 'yyyy-MM-dd-HH-mm-ss'
 SNAPSHOT_DAYS_FROM_NOW = 10
-ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS = 10
-ELASTICSEARCH_MAXIMUM_RESULTS_PER_PAGE = 10
-ELASTICSEARCH_SEARCH_CONTEXT_LIFETIME = '1m'  # 1 minute
+STREAM_PAGE_BYTES = 64 * 1024
 
 
-def _get_log_to_string(log: Any) -> str:
-    '''
-    Returns a string representation of the given log.
-    Convert single quotes to double quotes in order to match with JSON format
-    (required for streaming)
-    '''
-    return str(log['_source']).replace("'", '"')
-
-
-async def _get_logs_from_elasticsearch(
-    service_id: int,
-    start_date: str,
-    end_date: str,
-) -> dict:
-    '''
-    Coroutine that returns the first page of logs from ES.
-    '''
-    async with aiohttp.ClientSession() as session:
-        with async_timeout.timeout(ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS):
-            async with session.get(
-                'http://{}:{}/data-{}-*/_search?scroll={}'.format(
-                    ELASTICSEARCH_HOSTNAME,
-                    ELASTICSEARCH_PORT,
-                    service_id,
-                    ELASTICSEARCH_SEARCH_CONTEXT_LIFETIME,
-                ),
-                json={
-                    'size': ELASTICSEARCH_MAXIMUM_RESULTS_PER_PAGE,
-                    'query': {
-                        'bool': {
-                            'must': {
-                                'match': {
-                                    'service_id': service_id
-                                }
-                            },
-                            'filter': {
-                                'range': {
-                                    'date': {
-                                        'gte': start_date,
-                                        'lte': end_date,
-                                        'format': ELASTICSEARCH_DATE_FORMAT
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-            ) as response:
-                return await response.json()
-
-
-async def _scroll_logs_from_elasticsearch(
-    service_id: int,
-    scroll_id: str,
-) -> dict:
-    '''
-    Scroll the next page of found results from Elasticsearch.
-    '''
-    # TODO: #123 we use a new session for one request here;
-    # if we try to use the same session as before,
-    # then not all the logs are returned from ES;
-    # we have to investigate how to organize the session(s) here
-    async with aiohttp.ClientSession() as session:
-        with async_timeout.timeout(ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS):
-            async with session.get(
-                'http://{}:{}/_search/scroll'.format(
-                    ELASTICSEARCH_HOSTNAME,
-                    ELASTICSEARCH_PORT,
-                    service_id,
-                ),
-                json={
-                    'scroll': ELASTICSEARCH_SEARCH_CONTEXT_LIFETIME,
-                    'scroll_id': scroll_id
-                }
-            ) as response:
-                return await response.json()
-
-
-def _stream_logs_chunk(
-    stream: aiohttp.web_response.StreamResponse,
+def _get_page_bytes(
     logs: list,
-):
+    first_page: bool,
+) -> bytes:
     '''
-    Streams each log one by one to the client.
+    Returns the JSON representation of the sources of the given hits,
+    separated by commas (preceded by a comma if this is not the first page);
+    all the sources are encoded at once.
     '''
-    last_log_index = len(logs) - 1
+    page = encode([log['_source'] for log in logs])
 
-    for counter, log in enumerate(logs):
-        line = _get_log_to_string(log)
+    # removes the brackets of the encoded list
+    if first_page:
+        return page[1:-1]
 
-        if counter != last_log_index:
-            line += ','
-
-        stream.write(line.encode())
+    return b',' + page[1:-1]
 
 
 async def get_logs(
     request: web.Request,
-    es_client: Elasticsearch,
+    es_session: aiohttp.ClientSession,
+    indices_catalog: IndicesCatalog,
+    s3_client: AioBaseClient,
 ):
     '''
     Sends back logs according to the given dates range and service.
@@ -143,110 +63,112 @@ async def get_logs(
         API_DATE_FORMAT,
     )
 
-    result = await _get_logs_from_elasticsearch(
-        service_id,
-        start_date,
-        end_date,
+    indices = await indices_catalog.get_existing_indices(
+        get_range_indices(
+            service_id,
+            start,
+            end,
+        )
     )
 
-    stream = web.StreamResponse()
-    stream.content_type = 'application/json'
-    await stream.prepare(request)
-    stream.write(b'{"logs": [')
+    # the next ES pages are fetched while the current one is sent
+    prefetcher = PagesPrefetcher(
+        LogsPaginator(
+            es_session,
+            service_id,
+            indices,
+            start_date,
+            end_date,
+        ),
+        request.app.loop,
+    )
+    prefetcher.start()
 
-    scroll_id = result['_scroll_id']
-    logs = result['hits']['hits']
-    elasticsearch_logs_amount = len(logs)
+    try:
+        logs = await prefetcher.next_page()
 
-    first_iteration = False if elasticsearch_logs_amount > 0 else True
-    first_elasticsearch_scroll = True
+        stream = web.StreamResponse()
+        stream.content_type = 'application/json'
+        await stream.prepare(request)
+        writer = ResponseWriter(stream)
+        await writer.write(b'{"logs": [')
 
-    while elasticsearch_logs_amount > 0:
+        elasticsearch_logs_amount = len(logs)
 
-        if not first_elasticsearch_scroll:
-            stream.write(b',')
+        first_iteration = False if elasticsearch_logs_amount > 0 else True
+        first_elasticsearch_page = True
 
-        _stream_logs_chunk(
-            stream,
-            logs,
-        )
+        while elasticsearch_logs_amount > 0:
 
-        result = await _scroll_logs_from_elasticsearch(
-            service_id,
-            scroll_id,
-        )
+            await writer.write(
+                _get_page_bytes(
+                    logs,
+                    first_elasticsearch_page,
+                )
+            )
 
-        scroll_id = result['_scroll_id']
-        logs = result['hits']['hits']
-        elasticsearch_logs_amount = len(logs)
+            logs = await prefetcher.next_page()
+            elasticsearch_logs_amount = len(logs)
 
-        first_elasticsearch_scroll = False
+            first_elasticsearch_page = False
+
+    finally:
+        prefetcher.close()
 
     now = datetime.now()
     last_snapshot_date = now - timedelta(days=SNAPSHOT_DAYS_FROM_NOW)
     if start <= last_snapshot_date:
 
-        s3_index_date = start
-
-        s3_session = aiobotocore.get_session()
-        s3_client = s3_session.create_client(
-            service_name='s3',
-            region_name='',
-            aws_secret_access_key='',
-            aws_access_key_id='',
-            endpoint_url='http://' + S3_ENDPOINT,
-        )
-
-        while s3_index_date <= last_snapshot_date:
+        archive_start_date = start.isoformat()
+        archive_end_date = end.isoformat()
+        lines_start_date = archive_start_date.encode()
+        lines_end_date = archive_end_date.encode()
 
-            s3_index = 'data-%s-%04d-%02d-%02d' % (
+        # the next archived days are got while the current one is sent
+        fetcher = ArchivesFetcher(
+            s3_client,
+            get_range_indices(
                 service_id,
-                s3_index_date.year,
-                s3_index_date.month,
-                s3_index_date.day,
-            )
-
-            s3_index_date += timedelta(days=1)
-
-            s3_response = None
-
-            try:
-                s3_response = await s3_client.get_object(
-                    Bucket=S3_BUCKET_NAME,
-                    Key=s3_index,
-                )
-            except botocore.exceptions.ClientError:
-                continue
+                start,
+                min(end, last_snapshot_date),
+            ),
+            archive_start_date,
+            archive_end_date,
+            request.app.loop,
+        )
+        fetcher.start()
 
-            s3_stream = s3_response['Body']
-            s3_line = await s3_stream.readline()
+        try:
+            chunk = await fetcher.next_chunk()
+            page = bytearray()
 
-            while(len(s3_line) > 0):
+            while chunk:
 
-                temp_line = s3_line.decode('utf-8')
-                line_items = json.loads(temp_line)
-                log_date = datetime.strptime(
-                    line_items['date'],
-                    '%Y-%m-%dT%H:%M:%S',
+                lines = get_lines_in_range(
+                    chunk,
+                    lines_start_date,
+                    lines_end_date,
                 )
 
-                if log_date < start or log_date > end:
-                    s3_line = await s3_stream.readline()
-                    continue
+                if lines:
+                    if not first_iteration:
+                        page += b','
+                    first_iteration = False
 
-                line = str(line_items).replace("'", '"')
+                    page += b','.join(lines)
 
-                if not first_iteration:
-                    line = ',' + line
-                first_iteration = False
+                if len(page) >= STREAM_PAGE_BYTES:
+                    await writer.write(bytes(page))
+                    del page[:]
 
-                stream.write(line.encode())
+                chunk = await fetcher.next_chunk()
 
-                s3_line = await s3_stream.readline()
+            if page:
+                await writer.write(bytes(page))
 
-            s3_stream.close()
-        s3_client.close()
+        finally:
+            fetcher.close()
 
-    stream.write(b']}')
+    await writer.write(b']}')
 
     return stream
@@ -0,0 +1,199 @@
+'''
+Resolves the daily indices (data-{service}-YYYY-MM-DD) of the logs.
+'''
+import asyncio
+import logging
+import math
+import time
+from datetime import date, datetime
+from functools import lru_cache
+
+import aiohttp
+import async_timeout
+
+from logs.config import ELASTICSEARCH_HOSTNAME
+from logs.config import ELASTICSEARCH_PORT
+from logs.config import ELASTICSEARCH_INDICES_CATALOG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+INDEX_NAME_FORMAT = 'data-{}-{}'
+DAYS_CACHE_SIZE = 64
+# length of the YYYY-MM-DD suffix of an index name
+DAY_LENGTH = 10
+CATALOG_REQUEST_TIMEOUT_SECONDS = 10
+
+
+@lru_cache(maxsize=DAYS_CACHE_SIZE)
+def _get_day(day_number: int) -> str:
+    '''
+    Returns the YYYY-MM-DD representation of the given day
+    (amount of days since the epoch); almost all the logs of a batch
+    have the same day, so this is computed once per batch.
+    '''
+    return datetime.utcfromtimestamp(
+        day_number * SECONDS_PER_DAY
+    ).strftime('%Y-%m-%d')
+
+
+def get_index_name(
+    service_id: str,
+    day: str,
+) -> str:
+    '''
+    Returns the index name of the given service for the given YYYY-MM-DD day.
+    '''
+    return INDEX_NAME_FORMAT.format(service_id, day)
+
+
+def group_logs_by_index(
+    service_id: str,
+    logs: list,
+) -> dict:
+    '''
+    Converts the timestamp of every log into an ISO date,
+    adds the service id and groups the logs by daily index;
+    returns the positions of the logs of every index.
+    '''
+    groups = {}
+
+    for position, log in enumerate(logs):
+        timestamp = float(log['date'])
+        day_number, seconds = divmod(
+            int(math.floor(timestamp)),
+            SECONDS_PER_DAY,
+        )
+        day = _get_day(day_number)
+
+        if timestamp.is_integer():
+            hours, seconds = divmod(seconds, 3600)
+            minutes, seconds = divmod(seconds, 60)
+            log['date'] = '{}T{:02d}:{:02d}:{:02d}'.format(
+                day,
+                hours,
+                minutes,
+                seconds,
+            )
+        else:
+            log['date'] = datetime.utcfromtimestamp(timestamp).isoformat()
+
+        log['service_id'] = service_id
+
+        index = get_index_name(service_id, day)
+        if index not in groups:
+            groups[index] = []
+        groups[index].append(position)
+
+    return groups
+
+
+def get_range_indices(
+    service_id: str,
+    start: datetime,
+    end: datetime,
+) -> list:
+    '''
+    Returns the names of the daily indices of the given service
+    overlapping the given dates range, from the oldest one.
+    '''
+    return [
+        get_index_name(
+            service_id,
+            date.fromordinal(ordinal).isoformat(),
+        )
+        for ordinal in range(
+            start.date().toordinal(),
+            end.date().toordinal() + 1,
+        )
+    ]
+
+
+class IndicesCatalog:
+    '''
+    Cached list of the existing data indices,
+    used to search only the indices that really exist.
+
+    The list is got again from ES when it is older than the given delay;
+    indices of the day the list was got or later may have been created since,
+    so they are always considered as existing.
+    '''
+
+    def __init__(
+        self,
+        es_session: aiohttp.ClientSession,
+        loop: asyncio.AbstractEventLoop,
+        ttl_seconds: float=ELASTICSEARCH_INDICES_CATALOG_SECONDS,
+    ):
+        self._es_session = es_session
+        self._ttl_seconds = ttl_seconds
+        self._lock = asyncio.Lock(loop=loop)
+
+        self._indices = None
+        self._refreshed_at = None
+        self._refreshed_day = None
+
+    async def _refresh(self):
+        '''
+        Coroutine that gets the names of all the data indices from ES.
+        '''
+        refreshed_at = time.monotonic()
+        refreshed_day = datetime.utcnow().date().isoformat()
+
+        with async_timeout.timeout(CATALOG_REQUEST_TIMEOUT_SECONDS):
+            async with self._es_session.get(
+                'http://{}:{}/_cat/indices/{}'.format(
+                    ELASTICSEARCH_HOSTNAME,
+                    ELASTICSEARCH_PORT,
+                    INDEX_NAME_FORMAT.format('*', '*'),
+                ),
+                params={
+                    'h': 'index',
+                    'format': 'json',
+                },
+            ) as response:
+                response.raise_for_status()
+                rows = await response.json()
+
+        self._indices = frozenset(row['index'] for row in rows)
+        self._refreshed_at = refreshed_at
+        self._refreshed_day = refreshed_day
+
+    def _is_expired(self) -> bool:
+        '''
+        Indicates if the indices list has to be got again.
+        '''
+        return (
+            self._refreshed_at is None or
+            time.monotonic() - self._refreshed_at >= self._ttl_seconds
+        )
+
+    async def get_existing_indices(
+        self,
+        indices: list,
+    ) -> list:
+        '''
+        Coroutine that returns the given indices that may exist;
+        all of them are returned if the indices list cannot be got.
+        '''
+        if self._is_expired():
+            async with self._lock:
+
+                # another request may have got the list while waiting
+                if self._is_expired():
+                    try:
+                        await self._refresh()
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        logger.exception('cannot get the indices list')
+
+        if self._indices is None:
+            return indices
+
+        return [
+            index
+            for index in indices
+            if (
+                index in self._indices or
+                index[-DAY_LENGTH:] >= self._refreshed_day
+            )
+        ]
@@ -0,0 +1,344 @@
+'''
+Write-behind buffer coalescing the logs of many POST requests
+into large Elasticsearch bulk requests.
+'''
+import asyncio
+import logging
+from collections import Counter
+from functools import partial
+
+import aiohttp
+
+from logs.bulk import is_failure
+from logs.bulk import send_bulk
+from logs.write_ahead_log import WriteAheadLog
+
+from logs.config import ELASTICSEARCH_BULK_MAXIMUM_CONNECTIONS
+from logs.config import INGEST_BUFFER_MAXIMUM_LOGS
+from logs.config import INGEST_BUFFER_MAXIMUM_BYTES
+from logs.config import INGEST_BUFFER_FLUSH_INTERVAL_SECONDS
+from logs.config import INGEST_MAXIMUM_PENDING_BYTES
+from logs.config import INGEST_MAXIMUM_PENDING_BYTES_PER_SERVICE
+
+logger = logging.getLogger(__name__)
+
+
+class IngestBuffer:
+    '''
+    Queues serialized bulk entries and flushes them to ES
+    when the logs amount, the bytes amount or the flush interval is reached.
+
+    Pending bytes (queued or being indexed) are counted globally
+    and per service, so new requests can be refused when ES is too slow
+    to absorb the incoming logs.
+
+    When a write-ahead log is given, entries are appended to it
+    instead of being queued in memory, and are indexed by its replayer.
+    '''
+
+    def __init__(
+        self,
+        es_session: aiohttp.ClientSession,
+        loop: asyncio.AbstractEventLoop,
+        maximum_logs: int=INGEST_BUFFER_MAXIMUM_LOGS,
+        maximum_bytes: int=INGEST_BUFFER_MAXIMUM_BYTES,
+        flush_interval: float=INGEST_BUFFER_FLUSH_INTERVAL_SECONDS,
+        maximum_pending_bytes: int=INGEST_MAXIMUM_PENDING_BYTES,
+        maximum_pending_bytes_per_service: int=(
+            INGEST_MAXIMUM_PENDING_BYTES_PER_SERVICE
+        ),
+        write_ahead_log: WriteAheadLog=None,
+    ):
+        self._es_session = es_session
+        self._write_ahead_log = write_ahead_log
+        self._loop = loop
+        self._maximum_logs = maximum_logs
+        self._maximum_bytes = maximum_bytes
+        self._flush_interval = flush_interval
+        self._maximum_pending_bytes = maximum_pending_bytes
+        self._maximum_pending_bytes_per_service = (
+            maximum_pending_bytes_per_service
+        )
+
+        self._entries = []
+        self._bytes = 0
+        self._services_bytes = Counter()
+        self._waiters = []
+        self._flushes = set()
+        self._timer = None
+        self._writer = None
+        self._bulk_semaphore = asyncio.Semaphore(
+            ELASTICSEARCH_BULK_MAXIMUM_CONNECTIONS,
+            loop=loop,
+        )
+
+        self._pending_bytes = 0
+        self._pending_bytes_per_service = Counter()
+
+        if write_ahead_log is not None:
+            self._pending_bytes = write_ahead_log.get_recovered_bytes()
+
+        self.shed_requests = 0
+        self.shed_bytes = 0
+        self.shed_requests_per_service = Counter()
+
+        self.indexed_logs = 0
+        self.failed_logs = 0
+
+    def is_full(
+        self,
+        service_id: str,
+    ) -> bool:
+        '''
+        Indicates if the pending logs reached the global limit
+        or the limit of the given service.
+        '''
+        return (
+            self._pending_bytes >= self._maximum_pending_bytes or
+            self._pending_bytes_per_service[service_id] >=
+            self._maximum_pending_bytes_per_service
+        )
+
+    def shed(
+        self,
+        service_id: str,
+        content_length: int,
+    ):
+        '''
+        Counts one refused request of the given service.
+        '''
+        self.shed_requests += 1
+        self.shed_bytes += content_length or 0
+        self.shed_requests_per_service[service_id] += 1
+
+    def get_stats(self) -> dict:
+        '''
+        Returns the pending and shed amounts.
+        '''
+        indexed_logs = self.indexed_logs
+        failed_logs = self.failed_logs
+
+        if self._write_ahead_log is not None:
+            indexed_logs += self._write_ahead_log.indexed_logs
+            failed_logs += self._write_ahead_log.failed_logs
+
+        return {
+            'pending_bytes': self._pending_bytes,
+            'shed_requests': self.shed_requests,
+            'shed_bytes': self.shed_bytes,
+            'shed_requests_per_service': dict(self.shed_requests_per_service),
+            'indexed_logs': indexed_logs,
+            'failed_logs': failed_logs,
+        }
+
+    def add(
+        self,
+        service_id: str,
+        entries: list,
+        wait: bool=False,
+    ) -> asyncio.Future:
+        '''
+        Queues the given bulk entries of the given service;
+        flushes immediately if one of the size thresholds is reached.
+
+        If wait is set, returns a future resolved with the result
+        of every given entry once they are indexed.
+
+        With the write-ahead log, returns a future resolved (with None)
+        once the entries are written into the log; waiting for
+        the indexing is not supported.
+        '''
+        size = sum(len(entry) for entry in entries)
+
+        self._pending_bytes += size
+        self._pending_bytes_per_service[service_id] += size
+
+        if self._write_ahead_log is not None:
+            written = self._write_ahead_log.append(service_id, entries)
+            written.add_done_callback(
+                partial(
+                    self._release_unwritten,
+                    size,
+                    Counter({service_id: size}),
+                )
+            )
+            return written
+
+        waiter = None
+        if wait:
+            waiter = self._loop.create_future()
+            self._waiters.append(
+                (
+                    waiter,
+                    len(self._entries),
+                    len(entries),
+                )
+            )
+
+        self._entries.extend(entries)
+        self._bytes += size
+        self._services_bytes[service_id] += size
+
+        if (
+            len(self._entries) >= self._maximum_logs or
+            self._bytes >= self._maximum_bytes
+        ):
+            self._flush()
+
+        return waiter
+
+    def _flush(self):
+        '''
+        Takes all the queued entries and sends them in the background.
+        '''
+        if not self._entries:
+            return
+
+        entries = self._entries
+        services_bytes = self._services_bytes
+        waiters = self._waiters
+        self._entries = []
+        self._bytes = 0
+        self._services_bytes = Counter()
+        self._waiters = []
+
+        flush = asyncio.ensure_future(
+            self._send(
+                entries,
+                services_bytes,
+                waiters,
+            ),
+            loop=self._loop,
+        )
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+
+    async def _send(
+        self,
+        entries: list,
+        services_bytes: Counter,
+        waiters: list,
+    ):
+        '''
+        Coroutine that indexes the given entries into ES,
+        resolves the waiters with their results,
+        then releases their bytes from the pending amounts.
+        '''
+        try:
+            results = await send_bulk(
+                self._es_session,
+                self._bulk_semaphore,
+                entries,
+            )
+        except Exception as error:
+            logger.exception('cannot index %d buffered logs', len(entries))
+            self.failed_logs += len(entries)
+            for waiter, _, _ in waiters:
+                if not waiter.cancelled():
+                    waiter.set_exception(error)
+        else:
+            failed_logs = sum(1 for result in results if is_failure(result))
+            if failed_logs:
+                logger.error('cannot index %d buffered logs', failed_logs)
+
+            self.failed_logs += failed_logs
+            self.indexed_logs += len(results) - failed_logs
+
+            for waiter, start, count in waiters:
+                if not waiter.cancelled():
+                    waiter.set_result(results[start:start + count])
+        finally:
+            self._release(
+                sum(services_bytes.values()),
+                services_bytes,
+            )
+
+    def _release(
+        self,
+        size: int,
+        services_bytes: Counter,
+    ):
+        '''
+        Removes indexed bytes from the pending amounts.
+        '''
+        self._pending_bytes -= size
+        self._pending_bytes_per_service -= services_bytes
+
+    def _release_unwritten(
+        self,
+        size: int,
+        services_bytes: Counter,
+        written: asyncio.Future,
+    ):
+        '''
+        Removes the bytes the write-ahead log could not write
+        from the pending amounts, they will never be indexed.
+        '''
+        if written.cancelled() or written.exception() is not None:
+            self._release(size, services_bytes)
+
+    async def _flush_periodically(self):
+        '''
+        Coroutine that flushes the buffer at every flush interval,
+        so queued logs never wait longer than this interval.
+        '''
+        while True:
+            await asyncio.sleep(
+                self._flush_interval,
+                loop=self._loop,
+            )
+            self._flush()
+
+    def can_wait(self) -> bool:
+        '''
+        Indicates if the results of the indexing can be waited for,
+        which is not the case with the write-ahead log.
+        '''
+        return self._write_ahead_log is None
+
+    def start(self):
+        '''
+        Starts the periodic flush, or the write-ahead log writer and replay.
+        '''
+        if self._write_ahead_log is not None:
+            self._writer = asyncio.ensure_future(
+                self._write_ahead_log.write(),
+                loop=self._loop,
+            )
+            self._timer = asyncio.ensure_future(
+                self._write_ahead_log.replay(
+                    self._es_session,
+                    self._bulk_semaphore,
+                    self._release,
+                ),
+                loop=self._loop,
+            )
+            return
+
+        self._timer = asyncio.ensure_future(
+            self._flush_periodically(),
+            loop=self._loop,
+        )
+
+    async def close(self):
+        '''
+        Coroutine that stops the periodic flush,
+        flushes the remaining entries and waits for all the pending flushes;
+        the write-ahead log is closed once the appended entries are written,
+        its remaining segments are replayed when the service starts again.
+        '''
+        if self._timer is not None:
+            self._timer.cancel()
+
+        if self._write_ahead_log is not None:
+            if self._writer is not None:
+                await self._write_ahead_log.close(self._writer)
+            return
+
+        self._flush()
+
+        if self._flushes:
+            await asyncio.wait(
+                self._flushes,
+                loop=self._loop,
+            )
@@ -0,0 +1,65 @@
+'''
+Compact JSON encoding into UTF-8 bytes,
+using the fastest available encoder.
+'''
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+_encoder = json.JSONEncoder(
+    ensure_ascii=False,
+    separators=(',', ':'),
+)
+
+
+def _encode_with_orjson(value: object) -> bytes:
+    '''
+    Encodes the given value with orjson (returns bytes directly).
+    '''
+    return orjson.dumps(value)
+
+
+def _encode_with_ujson(value: object) -> bytes:
+    '''
+    Encodes the given value with ujson.
+    '''
+    return ujson.dumps(
+        value,
+        ensure_ascii=False,
+        escape_forward_slashes=False,
+    ).encode()
+
+
+def _encode_with_json(value: object) -> bytes:
+    '''
+    Encodes the given value with the standard library encoder.
+    '''
+    return _encoder.encode(value).encode()
+
+
+if orjson is not None:
+    _encode_fast = _encode_with_orjson
+elif ujson is not None:
+    _encode_fast = _encode_with_ujson
+else:
+    _encode_fast = _encode_with_json
+
+
+def encode(value: object) -> bytes:
+    '''
+    Encodes the given value with the fastest available encoder;
+    integers out of its range (64 bits) are valid JSON,
+    values containing them are encoded with the standard library encoder.
+    '''
+    try:
+        return _encode_fast(value)
+    except (TypeError, OverflowError):
+        return _encode_with_json(value)
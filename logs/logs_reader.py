@@ -0,0 +1,320 @@
+'''
+Incremental parsers of the POST /logs body (JSON or NDJSON),
+return the sent logs while the body is still being received.
+'''
+import codecs
+import json
+import re
+
+from aiohttp import streams
+
+READ_CHUNK_BYTES = 64 * 1024
+LOGS_KEY = 'logs'
+NDJSON_CONTENT_TYPES = (
+    'application/x-ndjson',
+    'application/ndjson',
+)
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# parsing states of the {"logs": [...]} body
+_OBJECT_START = 0
+_FIRST_KEY = 1
+_KEY = 2
+_COLON = 3
+_VALUE = 4
+_FIRST_LOG = 5
+_LOG = 6
+_AFTER_LOG = 7
+_AFTER_VALUE = 8
+_END = 9
+
+_INCOMPLETE = object()
+
+
+class PayloadError(Exception):
+    '''
+    Raised when the sent body is not a valid logs payload.
+    '''
+
+
+class PayloadTooLargeError(PayloadError):
+    '''
+    Raised when the sent body exceeds the maximum body size.
+    '''
+
+
+class _BodyReader:
+    '''
+    Reads the request stream chunk by chunk up to the maximum body size.
+    '''
+
+    def __init__(
+        self,
+        stream: streams.StreamReader,
+        maximum_bytes: int,
+    ):
+        self._stream = stream
+        self._maximum_bytes = maximum_bytes
+        self._bytes = 0
+        self._eof = False
+
+    async def _read_chunk(self) -> bytes:
+        '''
+        Coroutine that returns the next chunk of the body,
+        an empty chunk once the whole body has been read.
+        '''
+        chunk = await self._stream.read(READ_CHUNK_BYTES)
+
+        self._bytes += len(chunk)
+        if self._bytes > self._maximum_bytes:
+            raise PayloadTooLargeError(
+                'body is larger than {} bytes'.format(self._maximum_bytes)
+            )
+
+        if not chunk:
+            self._eof = True
+
+        return chunk
+
+
+class LogsReader(_BodyReader):
+    '''
+    Reads the logs array of a {"logs": [...]} JSON body element by element
+    from the request stream, so the logs can be processed
+    before the whole body is received.
+    '''
+
+    def __init__(
+        self,
+        stream: streams.StreamReader,
+        maximum_bytes: int,
+    ):
+        super().__init__(stream, maximum_bytes)
+
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+
+        self._state = _OBJECT_START
+        self._key = None
+        self._logs_found = False
+
+    async def read(self) -> list:
+        '''
+        Coroutine that returns the next received logs;
+        returns an empty list when all the logs have been read.
+        '''
+        while True:
+            logs = self._parse()
+            if logs:
+                return logs
+
+            if self._eof:
+                if self._state != _END:
+                    raise PayloadError('unexpected end of the body')
+                if not self._logs_found:
+                    raise PayloadError('missing logs array')
+                return []
+
+            await self._receive()
+
+    async def _receive(self):
+        '''
+        Coroutine that appends the next chunk of the body to the buffer.
+        '''
+        chunk = await self._read_chunk()
+
+        try:
+            text = self._text_decoder.decode(chunk, final=self._eof)
+        except UnicodeDecodeError:
+            raise PayloadError('body is not UTF-8 encoded')
+
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+
+    def _decode(self) -> object:
+        '''
+        Decodes the JSON value starting at the current position;
+        returns _INCOMPLETE if the value has not been entirely received.
+        '''
+        try:
+            value, end = self._json_decoder.raw_decode(
+                self._buffer,
+                self._position,
+            )
+        except ValueError:
+            if self._eof:
+                raise PayloadError('invalid JSON body')
+            return _INCOMPLETE
+
+        # a number at the end of the buffer may be truncated
+        if end == len(self._buffer) and not self._eof:
+            return _INCOMPLETE
+
+        self._position = end
+        return value
+
+    def _expect(
+        self,
+        character: str,
+        expected: str,
+    ):
+        '''
+        Consumes the current character, that must be the expected one.
+        '''
+        if character != expected:
+            raise PayloadError(
+                'expected "{}" at offset {}'.format(expected, self._position)
+            )
+        self._position += 1
+
+    def _parse(self) -> list:
+        '''
+        Parses as much of the buffer as possible,
+        returns the logs entirely received.
+        '''
+        logs = []
+
+        while True:
+            self._position = WHITESPACE.match(
+                self._buffer,
+                self._position,
+            ).end()
+
+            if self._position == len(self._buffer):
+                return logs
+
+            character = self._buffer[self._position]
+            state = self._state
+
+            if state == _OBJECT_START:
+                self._expect(character, '{')
+                self._state = _FIRST_KEY
+
+            elif state == _FIRST_KEY and character == '}':
+                self._position += 1
+                self._state = _END
+
+            elif state in (_FIRST_KEY, _KEY):
+                self._expect(character, '"')
+                self._position -= 1
+                key = self._decode()
+                if key is _INCOMPLETE:
+                    return logs
+                self._key = key
+                self._state = _COLON
+
+            elif state == _COLON:
+                self._expect(character, ':')
+                self._state = _VALUE
+
+            elif state == _VALUE and self._key == LOGS_KEY:
+                self._expect(character, '[')
+                self._logs_found = True
+                self._state = _FIRST_LOG
+
+            elif state == _VALUE:
+                if self._decode() is _INCOMPLETE:
+                    return logs
+                self._state = _AFTER_VALUE
+
+            elif state == _FIRST_LOG and character == ']':
+                self._position += 1
+                self._state = _AFTER_VALUE
+
+            elif state in (_FIRST_LOG, _LOG):
+                log = self._decode()
+                if log is _INCOMPLETE:
+                    return logs
+                if not isinstance(log, dict):
+                    raise PayloadError('every log must be an object')
+                logs.append(log)
+                self._state = _AFTER_LOG
+
+            elif state == _AFTER_LOG:
+                if character == ']':
+                    self._position += 1
+                    self._state = _AFTER_VALUE
+                else:
+                    self._expect(character, ',')
+                    self._state = _LOG
+
+            elif state == _AFTER_VALUE:
+                if character == '}':
+                    self._position += 1
+                    self._state = _END
+                else:
+                    self._expect(character, ',')
+                    self._state = _KEY
+
+            else:
+                raise PayloadError('unexpected data after the body')
+
+
+class NdjsonLogsReader(_BodyReader):
+    '''
+    Reads a NDJSON body (one log object per line) line by line
+    from the request stream.
+    '''
+
+    def __init__(
+        self,
+        stream: streams.StreamReader,
+        maximum_bytes: int,
+    ):
+        super().__init__(stream, maximum_bytes)
+        self._pending = b''
+
+    async def read(self) -> list:
+        '''
+        Coroutine that returns the logs of the next received lines;
+        returns an empty list when all the logs have been read.
+        '''
+        while not self._eof:
+            chunk = await self._read_chunk()
+
+            lines = (self._pending + chunk).split(b'\n')
+            self._pending = b'' if self._eof else lines.pop()
+
+            logs = [
+                self._decode(line)
+                for line in lines
+                if line.strip()
+            ]
+            if logs:
+                return logs
+
+        return []
+
+    def _decode(
+        self,
+        line: bytes,
+    ) -> dict:
+        '''
+        Decodes one line of the body.
+        '''
+        try:
+            log = json.loads(line.decode('utf-8'))
+        except ValueError:
+            raise PayloadError('invalid JSON line')
+
+        if not isinstance(log, dict):
+            raise PayloadError('every log must be an object')
+
+        return log
+
+
+def get_logs_reader(
+    content_type: str,
+    stream: streams.StreamReader,
+    maximum_bytes: int,
+) -> _BodyReader:
+    '''
+    Returns the reader matching the given body content type.
+    '''
+    if content_type in NDJSON_CONTENT_TYPES:
+        return NdjsonLogsReader(stream, maximum_bytes)
+
+    return LogsReader(stream, maximum_bytes)
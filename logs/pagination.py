@@ -0,0 +1,226 @@
+'''
+Pages through the logs of a service in Elasticsearch using search_after,
+fetching the next pages while the current one is sent.
+'''
+import asyncio
+import json
+
+import aiohttp
+import async_timeout
+
+from logs.indices import get_index_name
+
+from logs.config import ELASTICSEARCH_HOSTNAME
+from logs.config import ELASTICSEARCH_PORT
+from logs.config import ELASTICSEARCH_PAGE_SIZE
+from logs.config import ELASTICSEARCH_MINIMUM_PAGE_SIZE
+from logs.config import ELASTICSEARCH_MAXIMUM_PAGE_SIZE
+from logs.config import ELASTICSEARCH_PAGE_BYTES
+from logs.config import ELASTICSEARCH_PREFETCHED_PAGES
+
+ELASTICSEARCH_DATE_FORMAT = 'yyyy-MM-dd-HH-mm-ss'
+ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS = 10
+
+# ES refuses request lines longer than 4kB by default,
+# the indices pattern of the service is searched instead of a longer list
+MAXIMUM_INDICES_LIST_LENGTH = 3072
+
+# logs are sorted by date, the unique id makes the order total
+# so search_after never skips nor repeats a log
+LOGS_SORT = [
+    {'date': 'asc'},
+    {'_uid': 'asc'},
+]
+
+
+class LogsPaginator:
+    '''
+    Returns the logs of one service and dates range page by page,
+    only the given indices (the existing daily indices of the range)
+    are searched.
+
+    Every page starts after the sort values of the last log
+    of the previous page, so no search context is kept opened into ES.
+    The page size is adapted to the size of the logs,
+    in order to get pages of roughly the same amount of bytes.
+    '''
+
+    def __init__(
+        self,
+        es_session: aiohttp.ClientSession,
+        service_id: str,
+        indices: list,
+        start_date: str,
+        end_date: str,
+    ):
+        self._es_session = es_session
+        self._service_id = service_id
+        self._start_date = start_date
+        self._end_date = end_date
+
+        self._indices = ','.join(indices)
+        if len(self._indices) > MAXIMUM_INDICES_LIST_LENGTH:
+            self._indices = get_index_name(service_id, '*')
+
+        self._page_size = ELASTICSEARCH_PAGE_SIZE
+        self._search_after = None
+
+        # nothing to search if none of the indices of the range exists
+        self._finished = not indices
+
+    def _get_query(self) -> dict:
+        '''
+        Returns the search request body of the next page.
+        '''
+        query = {
+            'size': self._page_size,
+            'sort': LOGS_SORT,
+            'query': {
+                'bool': {
+                    'must': {
+                        'match': {
+                            'service_id': self._service_id
+                        }
+                    },
+                    'filter': {
+                        'range': {
+                            'date': {
+                                'gte': self._start_date,
+                                'lte': self._end_date,
+                                'format': ELASTICSEARCH_DATE_FORMAT
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        if self._search_after is not None:
+            query['search_after'] = self._search_after
+
+        return query
+
+    def _adapt_page_size(
+        self,
+        logs_amount: int,
+        page_bytes: int,
+    ):
+        '''
+        Sets the next page size in order to get the expected page bytes.
+        '''
+        log_bytes = max(page_bytes // logs_amount, 1)
+
+        self._page_size = min(
+            max(
+                ELASTICSEARCH_PAGE_BYTES // log_bytes,
+                ELASTICSEARCH_MINIMUM_PAGE_SIZE,
+            ),
+            ELASTICSEARCH_MAXIMUM_PAGE_SIZE,
+        )
+
+    async def next_page(self) -> list:
+        '''
+        Coroutine that returns the hits of the next page,
+        an empty list when all the logs have been returned.
+        '''
+        if self._finished:
+            return []
+
+        page_size = self._page_size
+
+        with async_timeout.timeout(ELASTICSEARCH_REQUESTS_TIMEOUT_SECONDS):
+            async with self._es_session.post(
+                'http://{}:{}/{}/_search'.format(
+                    ELASTICSEARCH_HOSTNAME,
+                    ELASTICSEARCH_PORT,
+                    self._indices,
+                ),
+                params={
+                    'filter_path': 'hits.hits._source,hits.hits.sort',
+                    # an index may have been removed by a snapshot since
+                    'ignore_unavailable': 'true',
+                    'allow_no_indices': 'true',
+                },
+                json=self._get_query(),
+            ) as response:
+                response.raise_for_status()
+                body = await response.read()
+
+        logs = json.loads(body.decode()).get('hits', {}).get('hits', [])
+
+        if len(logs) < page_size:
+            self._finished = True
+
+        if logs:
+            self._search_after = logs[-1]['sort']
+            self._adapt_page_size(len(logs), len(body))
+
+        return logs
+
+
+class PagesPrefetcher:
+    '''
+    Gets the next pages from a paginator in a background task,
+    while the previous pages are encoded and sent to the client;
+    at most the given amount of pages are fetched ahead.
+    '''
+
+    def __init__(
+        self,
+        paginator: LogsPaginator,
+        loop: asyncio.AbstractEventLoop,
+        maximum_pages: int=ELASTICSEARCH_PREFETCHED_PAGES,
+    ):
+        self._paginator = paginator
+        self._loop = loop
+        self._pages = asyncio.Queue(
+            maxsize=maximum_pages,
+            loop=loop,
+        )
+        self._task = None
+
+    def start(self):
+        '''
+        Starts to fetch the pages.
+        '''
+        self._task = asyncio.ensure_future(
+            self._fetch_pages(),
+            loop=self._loop,
+        )
+
+    async def _fetch_pages(self):
+        '''
+        Coroutine that puts the pages into the queue until the last one;
+        an error is put into the queue to be raised to the consumer.
+        '''
+        try:
+            logs = await self._paginator.next_page()
+            await self._pages.put(logs)
+
+            while logs:
+                logs = await self._paginator.next_page()
+                await self._pages.put(logs)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            await self._pages.put(error)
+
+    async def next_page(self) -> list:
+        '''
+        Coroutine that returns the hits of the next page,
+        an empty list when all the logs have been returned.
+        '''
+        logs = await self._pages.get()
+
+        if isinstance(logs, Exception):
+            raise logs
+
+        return logs
+
+    def close(self):
+        '''
+        Stops fetching pages (if the client is gone for instance).
+        '''
+        if self._task is not None:
+            self._task.cancel()
@@ -1,45 +1,165 @@
 '''
 Handles POST /logs requests.
 '''
-from datetime import datetime
-from elasticsearch import Elasticsearch, helpers
-
 from aiohttp import web
 
+from logs.bulk import get_bulk_entries
+from logs.bulk import is_failure
+from logs.indices import group_logs_by_index
+from logs.ingest_buffer import IngestBuffer
+from logs.logs_reader import get_logs_reader
+from logs.logs_reader import PayloadError
+from logs.logs_reader import PayloadTooLargeError
+from logs.validation import validate_logs
+
+from logs.config import INGEST_MAXIMUM_BODY_BYTES
+from logs.config import INGEST_RETRY_AFTER_SECONDS
+
+# compressed bodies are transparently decompressed
+# by the aiohttp parser while they are received
+SUPPORTED_CONTENT_ENCODINGS = (
+    'identity',
+    'gzip',
+    'deflate',
+)
+
+# result of the logs that are queued but not indexed yet,
+# and status of the logs that do not match the logs schema
+QUEUED_ITEM = {
+    'status': 202,
+    'error': None,
+}
+REJECTED_STATUS = 400
+
 
 async def post_logs(
     request: web.Request,
-    es_client: Elasticsearch,
+    ingest_buffer: IngestBuffer,
 ):
     '''
-    Save sent logs into ElasticSearch.
+    Queues sent logs for indexing into ElasticSearch;
+    logs are queued while the body (JSON or NDJSON, optionally compressed)
+    is received and the response is sent as soon as all of them are queued.
+
+    Logs not matching the logs schema are not indexed;
+    when there are such logs, the response contains the result of every log.
+    With the `wait=true` query parameter, the response is sent
+    once the logs are indexed and contains the result of every log
+    (refused with 400 when the write-ahead log is enabled).
+    With the write-ahead log, the response is sent once the logs are written.
     '''
-    data = await request.json()
-    logs = data['logs']
+    content_encoding = request.headers.get('Content-Encoding', 'identity')
+    if content_encoding.lower() not in SUPPORTED_CONTENT_ENCODINGS:
+        raise web.HTTPUnsupportedMediaType(
+            text='unsupported content encoding {}'.format(content_encoding)
+        )
 
-    service_id = request.match_info.get('id')
+    if (
+        request.content_length is not None and
+        request.content_length > INGEST_MAXIMUM_BODY_BYTES
+    ):
+        raise web.HTTPRequestEntityTooLarge()
 
-    for log in logs:
+    service_id = request.match_info.get('id')
 
-        # TODO: #125 almost everytime, indices have the same day,
-        # so this is superfluous to generate the index for each log;
-        # we should find a better way to handle indices creations
-        log_date = datetime.utcfromtimestamp(float(log['date']))
-        index = log_date.strftime('data-{}-%Y-%m-%d'.format(service_id))
+    # requests are admitted as long as the logs waiting to be indexed
+    # stay under the limits; already admitted requests are never interrupted
+    if ingest_buffer.is_full(service_id):
+        ingest_buffer.shed(
+            service_id,
+            request.content_length,
+        )
+        raise web.HTTPTooManyRequests(
+            headers={'Retry-After': str(INGEST_RETRY_AFTER_SECONDS)},
+        )
 
-        log.update(
-            {
-                '_type': 'logs',
-                'service_id': service_id,
-            }
+    wait = request.query.get('wait') == 'true'
+    if wait and not ingest_buffer.can_wait():
+        raise web.HTTPBadRequest(
+            text='wait is not supported with the write-ahead log'
         )
-        log['_index'] = index
-        log['date'] = log_date
 
-    helpers.bulk(
-        es_client,
-        logs,
-        index=index,
+    waiters = []
+    rejected_logs = []
+    received_logs = 0
+
+    reader = get_logs_reader(
+        request.content_type,
+        request.content,
+        INGEST_MAXIMUM_BODY_BYTES,
     )
 
-    return web.Response()
+    try:
+        logs = await reader.read()
+
+        while logs:
+
+            valid_logs, valid_positions, errors = validate_logs(logs)
+
+            for position, error in errors:
+                rejected_logs.append((received_logs + position, error))
+
+            for index, positions in group_logs_by_index(
+                service_id,
+                valid_logs,
+            ).items():
+                waiter = ingest_buffer.add(
+                    service_id,
+                    get_bulk_entries(
+                        index,
+                        [valid_logs[position] for position in positions],
+                    ),
+                    wait=wait,
+                )
+
+                if waiter is not None:
+                    waiters.append(
+                        (
+                            [
+                                received_logs + valid_positions[position]
+                                for position in positions
+                            ],
+                            waiter,
+                        )
+                    )
+
+            received_logs += len(logs)
+            logs = await reader.read()
+
+    except PayloadTooLargeError as error:
+        raise web.HTTPRequestEntityTooLarge(text=str(error))
+    except PayloadError as error:
+        raise web.HTTPBadRequest(text=str(error))
+
+    # the futures of the write-ahead log are resolved without results
+    # once the logs are written into it
+    results = []
+    for positions, waiter in waiters:
+        waiter_results = await waiter
+        if waiter_results is not None:
+            results.append((positions, waiter_results))
+
+    if not results and not rejected_logs:
+        return web.Response()
+
+    items = [QUEUED_ITEM] * received_logs
+
+    for position, error in rejected_logs:
+        items[position] = {
+            'status': REJECTED_STATUS,
+            'error': error,
+        }
+
+    for positions, waiter_results in results:
+        for position, result in zip(positions, waiter_results):
+            items[position] = {
+                'status': result['status'],
+                'error': result.get('error'),
+            }
+
+    return web.json_response(
+        {
+            'errors': any(is_failure(item) for item in items),
+            'items': items,
+        }
+    )
@@ -0,0 +1,50 @@
+'''
+Flow-controlled writes of streamed responses.
+'''
+import async_timeout
+
+from aiohttp import web
+
+from logs.config import RESPONSE_HIGH_WATER_BYTES
+from logs.config import RESPONSE_WRITE_TIMEOUT_SECONDS
+
+
+class ResponseWriter:
+    '''
+    Writes into a streamed response and waits for the client
+    to receive the written data every time the high-water mark is reached,
+    so a slow client pauses the reads of the logs
+    instead of letting the response grow in memory.
+    '''
+
+    def __init__(
+        self,
+        stream: web.StreamResponse,
+        high_water_bytes: int=RESPONSE_HIGH_WATER_BYTES,
+        timeout: float=RESPONSE_WRITE_TIMEOUT_SECONDS,
+    ):
+        self._stream = stream
+        self._high_water_bytes = high_water_bytes
+        self._timeout = timeout
+        self._undrained_bytes = 0
+
+    async def write(self, data: bytes):
+        '''
+        Coroutine that writes the given data,
+        raises asyncio.TimeoutError if the client does not receive
+        the written data before the write timeout.
+        '''
+        self._stream.write(data)
+        self._undrained_bytes += len(data)
+
+        if self._undrained_bytes >= self._high_water_bytes:
+            await self.drain()
+
+    async def drain(self):
+        '''
+        Coroutine that waits for the written data to be sent.
+        '''
+        with async_timeout.timeout(self._timeout):
+            await self._stream.drain()
+
+        self._undrained_bytes = 0
@@ -0,0 +1,96 @@
+'''
+Validates the sent logs against the logs schema before any I/O.
+'''
+from datetime import datetime
+
+# dates of the logs are computed with datetime,
+# timestamps must be between the first and the last second it represents
+EPOCH = datetime(1970, 1, 1)
+MINIMUM_TIMESTAMP = (datetime.min - EPOCH).total_seconds()
+MAXIMUM_TIMESTAMP = (
+    datetime.max.replace(microsecond=0) - EPOCH
+).total_seconds()
+
+
+def _is_text(value: object) -> bool:
+    '''
+    Indicates if the given value is a string.
+    '''
+    return type(value) is str
+
+
+def _is_timestamp(value: object) -> bool:
+    '''
+    Indicates if the given value is a timestamp a date can be computed from
+    (number or string containing a number).
+    '''
+    if type(value) not in (int, float, str):
+        return False
+
+    try:
+        timestamp = float(value)
+    except (ValueError, OverflowError):
+        return False
+
+    # NaN is refused as it is not comparable
+    return MINIMUM_TIMESTAMP <= timestamp <= MAXIMUM_TIMESTAMP
+
+
+# checked in this order, the first failing check is reported
+LOG_SCHEMA = (
+    ('message', _is_text, 'message must be a string'),
+    ('level', _is_text, 'level must be a string'),
+    ('category', _is_text, 'category must be a string'),
+    ('date', _is_timestamp, 'date must be a timestamp'),
+)
+
+_CHECKS = tuple(
+    (
+        field,
+        check,
+        'missing {}'.format(field),
+        error,
+    )
+    for field, check, error in LOG_SCHEMA
+)
+
+
+def get_log_error(log: dict) -> str:
+    '''
+    Returns the first schema error of the given log, None if it is valid.
+    '''
+    for field, check, missing_error, error in _CHECKS:
+        if field not in log:
+            return missing_error
+        if not check(log[field]):
+            return error
+
+    # fields starting with an underscore are ES metadata fields,
+    # ES refuses them inside a document
+    for field in log:
+        if field[:1] == '_':
+            return 'invalid field {}'.format(field)
+
+    return None
+
+
+def validate_logs(logs: list) -> tuple:
+    '''
+    Checks all the given logs in one pass;
+    returns the valid logs with their positions,
+    and the positions of the invalid logs with their errors.
+    '''
+    valid_logs = []
+    valid_positions = []
+    errors = []
+
+    for position, log in enumerate(logs):
+        error = get_log_error(log)
+
+        if error is None:
+            valid_logs.append(log)
+            valid_positions.append(position)
+        else:
+            errors.append((position, error))
+
+    return valid_logs, valid_positions, errors
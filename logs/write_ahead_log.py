@@ -0,0 +1,517 @@
+'''
+Append-only local log of the ingested bulk entries,
+replayed into Elasticsearch by a background task.
+'''
+import asyncio
+import logging
+import os
+import struct
+import time
+from collections import Counter
+
+import aiohttp
+
+from logs.bulk import is_failure
+from logs.bulk import is_retryable
+from logs.bulk import send_bulk
+
+from logs.config import INGEST_BUFFER_MAXIMUM_BYTES
+from logs.config import INGEST_WAL_SEGMENT_BYTES
+from logs.config import INGEST_WAL_SEGMENT_SECONDS
+from logs.config import INGEST_WAL_FSYNC_POLICY
+from logs.config import INGEST_WAL_RETRY_SECONDS
+from logs.config import INGEST_WAL_MAXIMUM_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_NAME_FORMAT = '{:020d}.wal'
+SEGMENT_EXTENSION = '.wal'
+
+# every entry is written after its length, so entries are read back
+# without looking at their content (source lines can contain any text)
+RECORD_HEADER = struct.Struct('>I')
+
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+
+
+def _get_record(entry: bytes) -> bytes:
+    '''
+    Returns the given entry framed as it is written into a segment.
+    '''
+    return RECORD_HEADER.pack(len(entry)) + entry
+
+
+def _get_entries(data: bytes) -> tuple:
+    '''
+    Returns the entries of the given segment content,
+    with the length of the complete records; the last record of the segment
+    may be torn if the worker stopped abruptly or if a write failed.
+    '''
+    view = memoryview(data)
+    entries = []
+    start = 0
+
+    while start + RECORD_HEADER.size <= len(data):
+        entry_start = start + RECORD_HEADER.size
+        entry_end = entry_start + RECORD_HEADER.unpack_from(data, start)[0]
+
+        if entry_end > len(data):
+            break
+
+        entries.append(view[entry_start:entry_end])
+        start = entry_end
+
+    return entries, start
+
+
+def _get_chunks(
+    entries: list,
+    maximum_bytes: int,
+) -> list:
+    '''
+    Splits the given entries into chunks of about the given size,
+    one bulk request per chunk.
+    '''
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+
+    for entry in entries:
+        chunk.append(entry)
+        chunk_bytes += len(entry)
+
+        if chunk_bytes >= maximum_bytes:
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def _read_segment(path: str) -> bytes:
+    '''
+    Returns the content of the given segment file.
+    '''
+    with open(path, 'rb') as segment_file:
+        return segment_file.read()
+
+
+def _remove_segment(path: str):
+    '''
+    Removes the file of the given replayed segment, if it exists.
+    '''
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class _Segment:
+    '''
+    One file of the write-ahead log.
+    '''
+
+    def __init__(
+        self,
+        path: str,
+        size: int=0,
+    ):
+        self.path = path
+        self.size = size
+        # bytes of the entries (without their length), counted as pending
+        # by the ingest buffer; the recovered segments are counted entirely
+        self.entries_bytes = size
+        self.services_bytes = Counter()
+        self.opened_at = time.monotonic()
+        self.replayed = False
+
+
+class WriteAheadLog:
+    '''
+    Appends the bulk entries into segment files rotated by size and age;
+    sealed segments are sent to ES in large bulk requests
+    and removed once ES acknowledged all their entries.
+
+    Files are written by a background task in an executor,
+    the entries appended while the previous write is running
+    are written (and synced) together.
+    '''
+
+    def __init__(
+        self,
+        directory: str,
+        loop: asyncio.AbstractEventLoop,
+        segment_bytes: int=INGEST_WAL_SEGMENT_BYTES,
+        segment_seconds: float=INGEST_WAL_SEGMENT_SECONDS,
+        fsync_policy: str=INGEST_WAL_FSYNC_POLICY,
+        bulk_bytes: int=INGEST_BUFFER_MAXIMUM_BYTES,
+    ):
+        assert fsync_policy in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+        self._directory = directory
+        self._loop = loop
+        self._segment_bytes = segment_bytes
+        self._segment_seconds = segment_seconds
+        self._fsync_policy = fsync_policy
+        self._bulk_bytes = bulk_bytes
+
+        os.makedirs(directory, exist_ok=True)
+
+        names = sorted(
+            name
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_EXTENSION)
+        )
+
+        # segments left by a previous run are replayed first
+        self._sealed = [
+            _Segment(
+                os.path.join(directory, name),
+                os.path.getsize(os.path.join(directory, name)),
+            )
+            for name in names
+        ]
+        self._next_sequence = (
+            int(names[-1][:-len(SEGMENT_EXTENSION)]) + 1 if names else 0
+        )
+
+        self._active = None
+        self._file = None
+
+        # entries appended since the last write, with the future
+        # resolved once they are written
+        self._appended = []
+        self._appended_services_bytes = Counter()
+        self._written = None
+        self._append_event = asyncio.Event(loop=loop)
+        self._closing = False
+
+        self.indexed_logs = 0
+        self.failed_logs = 0
+
+    def get_recovered_bytes(self) -> int:
+        '''
+        Returns the size of the segments left by a previous run.
+        '''
+        return sum(segment.entries_bytes for segment in self._sealed)
+
+    def append(
+        self,
+        service_id: str,
+        entries: list,
+    ) -> asyncio.Future:
+        '''
+        Queues the given entries of the given service for the active segment;
+        returns a future resolved once they are written
+        (and synced with the always policy).
+        '''
+        if self._written is None:
+            self._written = self._loop.create_future()
+
+        self._appended.extend(_get_record(entry) for entry in entries)
+        self._appended_services_bytes[service_id] += sum(
+            len(entry) for entry in entries
+        )
+        self._append_event.set()
+
+        return self._written
+
+    def _open(self):
+        '''
+        Opens a new active segment; no segment is active
+        if its file cannot be opened.
+        '''
+        path = os.path.join(
+            self._directory,
+            SEGMENT_NAME_FORMAT.format(self._next_sequence),
+        )
+        self._next_sequence += 1
+
+        self._file = open(path, 'ab')
+        self._active = _Segment(path)
+
+    def _write_file(
+        self,
+        data: bytes,
+    ):
+        '''
+        Writes the given data into the active segment (run in an executor).
+        '''
+        if self._active is None:
+            self._open()
+
+        self._file.write(data)
+        self._file.flush()
+
+        if self._fsync_policy == FSYNC_ALWAYS:
+            os.fsync(self._file.fileno())
+
+    def _close_file(self):
+        '''
+        Syncs and closes the file of the active segment
+        (run in an executor).
+        '''
+        try:
+            if self._fsync_policy != FSYNC_NEVER:
+                os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+
+    async def _write(self):
+        '''
+        Coroutine that writes the appended entries into the active segment
+        and resolves their future.
+        '''
+        data = b''.join(self._appended)
+        services_bytes = self._appended_services_bytes
+        written = self._written
+
+        self._appended = []
+        self._appended_services_bytes = Counter()
+        self._written = None
+
+        try:
+            await self._loop.run_in_executor(
+                None,
+                self._write_file,
+                data,
+            )
+        except Exception as error:
+            logger.exception('cannot write the write-ahead log')
+            written.set_exception(error)
+
+            # the segment may end with a torn entry (skipped when replayed),
+            # the next entries are written into a new segment
+            await self._seal()
+            return
+
+        self._active.size += len(data)
+        self._active.entries_bytes += sum(services_bytes.values())
+        self._active.services_bytes += services_bytes
+        written.set_result(None)
+
+    async def _seal(self):
+        '''
+        Coroutine that closes the active segment
+        and makes it available for replay.
+        '''
+        if self._active is None:
+            return
+
+        if self._file is not None:
+            try:
+                await self._loop.run_in_executor(
+                    None,
+                    self._close_file,
+                )
+            except Exception:
+                logger.exception('cannot sync %s', self._active.path)
+
+        self._sealed.append(self._active)
+        self._active = None
+        self._file = None
+
+    async def write(self):
+        '''
+        Coroutine that writes the appended entries until the log is closed,
+        and seals the active segment when it is too large or too old.
+        '''
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._append_event.wait(),
+                    self._segment_seconds,
+                    loop=self._loop,
+                )
+            except asyncio.TimeoutError:
+                pass
+
+            self._append_event.clear()
+
+            if self._appended:
+                await self._write()
+
+            if self._closing:
+                return
+
+            if self._active is not None and (
+                self._active.size >= self._segment_bytes or
+                time.monotonic() - self._active.opened_at >=
+                self._segment_seconds
+            ):
+                await self._seal()
+
+    async def replay(
+        self,
+        es_session: aiohttp.ClientSession,
+        bulk_semaphore: asyncio.Semaphore,
+        release: callable,
+    ):
+        '''
+        Coroutine that sends the sealed segments to ES forever,
+        holding the given semaphore during every bulk request;
+        the given release function is called with the entries bytes
+        and the services bytes of every acknowledged segment.
+
+        A segment that cannot be replayed or removed is tried again
+        after a delay, so the replay never stops.
+        '''
+        while True:
+            if not self._sealed:
+                await asyncio.sleep(
+                    self._segment_seconds,
+                    loop=self._loop,
+                )
+                continue
+
+            segment = self._sealed[0]
+
+            try:
+                if not segment.replayed:
+                    await self._replay_segment(
+                        es_session,
+                        bulk_semaphore,
+                        segment,
+                    )
+                    segment.replayed = True
+
+                _remove_segment(segment.path)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('cannot replay %s', segment.path)
+                await asyncio.sleep(
+                    INGEST_WAL_RETRY_SECONDS,
+                    loop=self._loop,
+                )
+                continue
+
+            self._sealed.pop(0)
+            release(segment.entries_bytes, segment.services_bytes)
+
+    async def _replay_entries(
+        self,
+        es_session: aiohttp.ClientSession,
+        bulk_semaphore: asyncio.Semaphore,
+        segment: _Segment,
+        entries: list,
+    ):
+        '''
+        Coroutine that sends the given entries of the given segment to ES,
+        sends again the entries rejected because ES is overloaded
+        until they are acknowledged; the entries of a bulk request
+        ES keeps refusing entirely are dropped after the maximum attempts.
+        '''
+        attempts = 0
+
+        while entries:
+            try:
+                results = await send_bulk(
+                    es_session,
+                    bulk_semaphore,
+                    entries,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('cannot replay %s', segment.path)
+                results = None
+
+            if results is None:
+                attempts += 1
+
+                if attempts >= INGEST_WAL_MAXIMUM_ATTEMPTS:
+                    logger.error(
+                        'dropping %d logs of %s after %d attempts',
+                        len(entries),
+                        segment.path,
+                        attempts,
+                    )
+                    self.failed_logs += len(entries)
+                    return
+            else:
+                rejected = sum(
+                    1
+                    for result in results
+                    if is_failure(result) and not is_retryable(result)
+                )
+                if rejected:
+                    logger.error(
+                        '%d logs of %s rejected by ES',
+                        rejected,
+                        segment.path,
+                    )
+
+                # only the entries ES could not absorb are sent again
+                retried = [
+                    entry
+                    for entry, result in zip(entries, results)
+                    if is_retryable(result)
+                ]
+
+                self.failed_logs += rejected
+                self.indexed_logs += len(entries) - len(retried) - rejected
+                entries = retried
+
+            if entries:
+                await asyncio.sleep(
+                    INGEST_WAL_RETRY_SECONDS,
+                    loop=self._loop,
+                )
+
+    async def _replay_segment(
+        self,
+        es_session: aiohttp.ClientSession,
+        bulk_semaphore: asyncio.Semaphore,
+        segment: _Segment,
+    ):
+        '''
+        Coroutine that sends all the entries of the given segment to ES,
+        chunk after chunk.
+        '''
+        try:
+            data = await self._loop.run_in_executor(
+                None,
+                _read_segment,
+                segment.path,
+            )
+        except FileNotFoundError:
+            logger.warning('missing segment %s', segment.path)
+            return
+
+        entries, length = _get_entries(data)
+        if length != len(data):
+            logger.warning(
+                'ignoring %d bytes of torn entries in %s',
+                len(data) - length,
+                segment.path,
+            )
+
+        for chunk in _get_chunks(entries, self._bulk_bytes):
+            await self._replay_entries(
+                es_session,
+                bulk_semaphore,
+                segment,
+                chunk,
+            )
+
+    async def close(
+        self,
+        writer: asyncio.Future,
+    ):
+        '''
+        Coroutine that stops the given writer task once the appended entries
+        are written and seals the active segment, remaining segments
+        are replayed when the service starts again.
+        '''
+        self._closing = True
+        self._append_event.set()
+        await writer
+
+        await self._seal()
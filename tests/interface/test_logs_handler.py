@@ -2,6 +2,8 @@
 Tests for POST logs
 '''
 import os
+import gzip
+import json
 import time
 from datetime import datetime
 
@@ -40,7 +42,7 @@ def test_post_log():
     }
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=json,
     )
     assert response.status_code == 200
@@ -152,7 +154,7 @@ def test_post_two_logs_at_two_different_days():
     }
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=json,
     )
     assert response.status_code == 200
@@ -213,3 +215,143 @@ def test_post_two_logs_at_two_different_days():
     logs_amount = result['hits']['total']
     assert logs_amount == 1, \
         'unexpected logs amount, got %s, expected 1' % logs_amount
+
+
+def test_post_gzip_ndjson_logs():
+    '''
+    Post two logs as a gzip compressed NDJSON body
+    and checks that both logs are inserted into elasticsearch.
+    '''
+    es_client = Elasticsearch([ELASTICSEARCH_HOSTNAME])
+    remove_all_data_indices(es_client)
+    time.sleep(WAIT_TIME)
+
+    # August 9, 2017 06:56:12 pm
+    log_timestamp = 1502304972
+
+    lines = [
+        json.dumps(
+            {
+                'message': 'a log message with an apostrophe \'',
+                'level': 'a low level',
+                'category': 'a category',
+                'date': str(log_timestamp + seconds),
+            }
+        )
+        for seconds in range(2)
+    ]
+
+    response = requests.post(
+        BASE_URL + '/logs?wait=true',
+        data=gzip.compress('\n'.join(lines).encode()),
+        headers={
+            'Content-Type': 'application/x-ndjson',
+            'Content-Encoding': 'gzip',
+        },
+    )
+    assert response.status_code == 200
+    time.sleep(WAIT_TIME)
+
+    result = es_client.search(
+        index='data-1-2017-08-09',
+        body={
+            'query': {
+                'bool': {
+                    'must': {
+                        'match': {
+                            'service_id': '1'
+                        },
+                    },
+                }
+            }
+        }
+    )
+
+    logs_amount = result['hits']['total']
+    assert logs_amount == 2, \
+        'unexpected logs amount, got %s, expected 2' % logs_amount
+
+
+def test_post_malformed_logs():
+    '''
+    Checks that post logs returns 400 when the body is not a logs payload.
+    '''
+    response = requests.post(
+        BASE_URL + '/logs',
+        data='{"logs": [{"message": "a log message"',
+        headers={'Content-Type': 'application/json'},
+    )
+    assert response.status_code == 400
+
+
+def test_post_logs_with_invalid_log():
+    '''
+    Post one valid log and one log without date,
+    checks that only the invalid log is reported as rejected.
+    '''
+    json = {
+        'logs': [
+            {
+                'message': 'a first log message',
+                'level': 'a low level',
+                'category': 'a first category',
+                'date': '1502304972',
+            },
+            {
+                'message': 'a second log message',
+                'level': 'a low level',
+                'category': 'a second category',
+            }
+        ]
+    }
+
+    response = requests.post(
+        BASE_URL + '/logs',
+        json=json,
+    )
+    assert response.status_code == 200
+
+    result = response.json()
+    assert result['errors']
+    assert result['items'][0]['status'] == 202
+    assert result['items'][1]['status'] == 400
+    assert result['items'][1]['error'] == 'missing date'
+
+
+def test_post_logs_with_out_of_range_dates():
+    '''
+    Post one valid log and logs with timestamps no date can be computed from,
+    checks that only these logs are reported as rejected.
+    '''
+    json = {
+        'logs': [
+            {
+                'message': 'a first log message',
+                'level': 'a low level',
+                'category': 'a first category',
+                'date': '1502304972',
+            }
+        ] + [
+            {
+                'message': 'an out of range log message',
+                'level': 'a low level',
+                'category': 'a second category',
+                'date': date,
+            }
+            for date in (10**400, 1e20, '99999999999999', -1e12)
+        ]
+    }
+
+    response = requests.post(
+        BASE_URL + '/logs',
+        json=json,
+    )
+    assert response.status_code == 200
+
+    result = response.json()
+    assert result['errors']
+    assert result['items'][0]['status'] == 202
+
+    for item in result['items'][1:]:
+        assert item['status'] == 400
+        assert item['error'] == 'date must be a timestamp'
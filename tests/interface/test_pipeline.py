@@ -83,7 +83,7 @@ def test_post_and_upload():
     index = log_datetime.strftime('data-{}-%Y-%m-%d'.format(SERVICE_ID))
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=json,
     )
     assert response.status_code == 200
@@ -111,6 +111,17 @@ def test_post_and_upload():
         )
     )
     assert response.status_code == 200
+
+    # the archive index lists one block containing the log
+    response = requests.get(
+        'http://{}/{}/{}.index'.format(
+            S3_ENDPOINT,
+            S3_BUCKET_NAME,
+            index,
+        )
+    )
+    assert response.status_code == 200
+    assert response.json()['blocks'][0][:2] == [log_date, log_date]
     time.sleep(WAIT_TIME)
 
     result = es_client.search(
@@ -175,7 +186,7 @@ def test_two_posts_at_different_times_should_only_update_one_to_s3():
     }
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=first_json,
     )
     assert response.status_code == 200
@@ -209,7 +220,7 @@ def test_two_posts_at_different_times_should_only_update_one_to_s3():
     }
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=second_json,
     )
     assert response.status_code == 200
@@ -353,7 +364,7 @@ def test_get_different_second_from_identical_index_from_es():
     }
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=first_json,
     )
     assert response.status_code == 200
@@ -412,7 +423,7 @@ def test_get_different_hour_from_identical_index_from_es():
     }
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=first_json,
     )
     assert response.status_code == 200
@@ -471,7 +482,7 @@ def test_get_different_day_from_identical_index_from_es():
     }
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=first_json,
     )
     assert response.status_code == 200
@@ -531,7 +542,7 @@ def test_get_different_second_from_identical_index_from_s3():
     }
 
     response = requests.post(
-        BASE_URL + '/logs',
+        BASE_URL + '/logs?wait=true',
         json=first_json,
     )
     assert response.status_code == 200
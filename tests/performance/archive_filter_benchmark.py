@@ -0,0 +1,114 @@
+'''
+This script is used for tests purposes only.
+
+Compares the filtering of one archived day for GET logs responses:
+decoding, parsing the date and encoding again every line (previous path)
+against comparing the date bytes of every line.
+'''
+
+import json
+import timeit
+from collections import OrderedDict
+from datetime import datetime
+
+from logs.archives import get_lines_in_range
+from logs.json_encoder import encode
+
+LOGS_AMOUNT = 100000
+REPEAT = 3
+
+# the requested range covers the middle of the day
+START = datetime(2017, 8, 9, 6, 0, 0)
+END = datetime(2017, 8, 9, 18, 0, 0)
+
+
+def _get_chunk() -> bytes:
+    '''
+    Returns one archived day, as written by the snapshot script.
+    '''
+    return ''.join(
+        json.dumps(
+            OrderedDict([
+                (
+                    'date',
+                    '2017-08-09T{:02d}:{:02d}:{:02d}'.format(
+                        counter * 24 // LOGS_AMOUNT,
+                        counter % 60,
+                        counter % 60,
+                    ),
+                ),
+                ('message', 'a log message number {}'.format(counter)),
+                ('level', 'a low level'),
+                ('category', 'a category'),
+                ('service_id', '1'),
+            ])
+        ) + '\n'
+        for counter in range(LOGS_AMOUNT)
+    ).encode()
+
+
+def _filter_with_parsing(chunk: bytes) -> bytes:
+    '''
+    Parses every line and encodes the lines of the range (previous path).
+    '''
+    page = bytearray()
+
+    for line in chunk.splitlines():
+        line_items = json.loads(line.decode('utf-8'))
+        log_date = datetime.strptime(
+            line_items['date'],
+            '%Y-%m-%dT%H:%M:%S',
+        )
+
+        if log_date < START or log_date > END:
+            continue
+
+        page += b','
+        page += encode(line_items)
+
+    return bytes(page)
+
+
+def _filter_with_bytes(chunk: bytes) -> bytes:
+    '''
+    Compares the date bytes of every line.
+    '''
+    return b','.join(
+        get_lines_in_range(
+            chunk,
+            START.isoformat().encode(),
+            END.isoformat().encode(),
+        )
+    )
+
+
+def main():
+    '''
+    Script entry point.
+    '''
+    chunk = _get_chunk()
+
+    for name, function in (
+        ('parsing', _filter_with_parsing),
+        ('bytes', _filter_with_bytes),
+    ):
+        seconds = min(
+            timeit.repeat(
+                lambda: function(chunk),
+                number=1,
+                repeat=REPEAT,
+            )
+        )
+
+        print(
+            '{:>7}: {:8.1f} ms, {:10.0f} lines/s, {:7.1f} MB/s'.format(
+                name,
+                seconds * 1000,
+                LOGS_AMOUNT / seconds,
+                len(chunk) / seconds / 1024 / 1024,
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+'''
+This script is used for tests purposes only.
+
+Compares the time required to serialize logs batches into a bulk body
+using the elasticsearch helpers (previous POST logs path)
+and using the bulk entries builder of the service.
+'''
+
+import timeit
+from datetime import datetime
+
+from elasticsearch.helpers import expand_action
+from elasticsearch.serializer import JSONSerializer
+
+from logs.bulk import get_bulk_body
+from logs.bulk import get_bulk_entries
+
+BATCHES_SIZES = (1000, 10000, 100000)
+REPEAT = 3
+
+# August 9, 2017 06:56:12 pm
+TIMESTAMP = 1502304972
+INDEX = 'data-1-2017-08-09'
+
+
+def _get_logs(amount: int) -> list:
+    '''
+    Returns the given amount of logs, as they are before serialization.
+    '''
+    return [
+        {
+            'message': 'a log message number {}'.format(counter),
+            'level': 'a low level',
+            'category': 'a category',
+            'date': datetime.utcfromtimestamp(TIMESTAMP + counter),
+        }
+        for counter in range(amount)
+    ]
+
+
+def _serialize_with_helpers(logs: list) -> bytes:
+    '''
+    Serializes the logs the way helpers.bulk does.
+    '''
+    serializer = JSONSerializer()
+    lines = []
+
+    for log in logs:
+        log = dict(log)
+        log['_index'] = INDEX
+        log['_type'] = 'logs'
+        log['service_id'] = '1'
+
+        action, source = expand_action(log)
+        lines.append(serializer.dumps(action))
+        lines.append(serializer.dumps(source))
+
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def _serialize_with_builder(logs: list) -> bytes:
+    '''
+    Serializes the logs using the bulk entries builder.
+    '''
+    logs = [dict(log) for log in logs]
+
+    for log in logs:
+        log['date'] = log['date'].isoformat()
+        log['service_id'] = '1'
+
+    return get_bulk_body(get_bulk_entries(INDEX, logs))
+
+
+def main():
+    '''
+    Script entry point.
+    '''
+    for batch_size in BATCHES_SIZES:
+        logs = _get_logs(batch_size)
+        body_bytes = len(_serialize_with_builder(logs))
+
+        for name, function in (
+            ('helpers', _serialize_with_helpers),
+            ('builder', _serialize_with_builder),
+        ):
+            seconds = min(
+                timeit.repeat(
+                    lambda: function(logs),
+                    number=1,
+                    repeat=REPEAT,
+                )
+            )
+
+            print(
+                '{:>7} logs {}: {:8.1f} ms, {:10.0f} logs/s, {:7.1f} MB/s'
+                .format(
+                    batch_size,
+                    name,
+                    seconds * 1000,
+                    batch_size / seconds,
+                    body_bytes / seconds / 1024 / 1024,
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
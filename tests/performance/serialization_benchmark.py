@@ -0,0 +1,155 @@
+'''
+This script is used for tests purposes only.
+
+Compares the serialization of ES pages for GET logs responses:
+one string and one write per log (previous path)
+against one encoding and one write per page;
+the allocations of both paths are measured with tracemalloc.
+'''
+
+import timeit
+import tracemalloc
+
+from logs.get_logs_handler import _get_page_bytes
+
+PAGES_AMOUNT = 100
+PAGE_SIZE = 1000
+REPEAT = 3
+
+
+class _Stream:
+    '''
+    Keeps the written chunks instead of sending them,
+    as the aiohttp transport buffers them until the client receives them.
+    '''
+
+    def __init__(self):
+        self.chunks = []
+        self.bytes = 0
+
+    def write(self, data: bytes):
+        '''
+        Buffers one written chunk.
+        '''
+        self.chunks.append(data)
+        self.bytes += len(data)
+
+
+def _measure_allocations(
+    function: callable,
+    pages: list,
+) -> tuple:
+    '''
+    Returns the amount of memory blocks allocated by the given streaming
+    function and still used once all the pages are written
+    (the buffered chunks), with the peak of the allocated bytes.
+    '''
+    stream = _Stream()
+
+    tracemalloc.start()
+    function(stream, pages)
+    snapshot = tracemalloc.take_snapshot()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    blocks = sum(
+        statistic.count
+        for statistic in snapshot.statistics('filename')
+    )
+
+    return blocks, peak_bytes
+
+
+def _get_pages() -> list:
+    '''
+    Returns ES pages of hits.
+    '''
+    return [
+        [
+            {
+                '_source': {
+                    'message': 'a log message number {}'.format(counter),
+                    'level': 'a low level',
+                    'category': 'a category',
+                    'date': '2017-08-09T18:56:12',
+                    'service_id': '1',
+                }
+            }
+            for counter in range(PAGE_SIZE)
+        ]
+        for _ in range(PAGES_AMOUNT)
+    ]
+
+
+def _stream_per_log(
+    stream: _Stream,
+    pages: list,
+):
+    '''
+    Streams the pages one log after another (previous path).
+    '''
+    for page_counter, logs in enumerate(pages):
+
+        if page_counter != 0:
+            stream.write(b',')
+
+        last_log_index = len(logs) - 1
+
+        for counter, log in enumerate(logs):
+            line = str(log['_source']).replace("'", '"')
+
+            if counter != last_log_index:
+                line += ','
+
+            stream.write(line.encode())
+
+
+def _stream_per_page(
+    stream: _Stream,
+    pages: list,
+):
+    '''
+    Streams the pages one page after another.
+    '''
+    for page_counter, logs in enumerate(pages):
+        stream.write(_get_page_bytes(logs, page_counter == 0))
+
+
+def main():
+    '''
+    Script entry point.
+    '''
+    pages = _get_pages()
+
+    for name, function in (
+        ('per log', _stream_per_log),
+        ('per page', _stream_per_page),
+    ):
+        stream = _Stream()
+        function(stream, pages)
+
+        seconds = min(
+            timeit.repeat(
+                lambda: function(_Stream(), pages),
+                number=1,
+                repeat=REPEAT,
+            )
+        )
+
+        blocks, peak_bytes = _measure_allocations(function, pages)
+
+        print(
+            '{:>8}: {:7.1f} ms, {:6.1f} MB/s, {:6} writes, '
+            '{:7} allocated blocks, {:6.1f} MB peak'.format(
+                name,
+                seconds * 1000,
+                stream.bytes / seconds / 1024 / 1024,
+                len(stream.chunks),
+                blocks,
+                peak_bytes / 1024 / 1024,
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,434 @@
+'''
+Tests for the archives format: frames written by the snapshot script
+and read back by the service
+'''
+import asyncio
+import io
+import os
+import sys
+
+import botocore.exceptions
+import pytest
+
+from logs.archives import ArchiveError
+from logs.archives import ArchivesFetcher
+from logs.archives import _ArchiveDecompressor
+from logs.archives import get_archive_ranges
+from logs.archives import get_lines_in_range
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__),
+        '../../build_scripts/scripts',
+    )
+)
+import create_snapshot  # noqa
+
+COMPRESSIONS = ['gzip', 'none']
+if create_snapshot.zstandard is not None:
+    COMPRESSIONS.append('zstd')
+
+CHUNKS_SIZES = (1, 3, 7, 1000, 1000000)
+LOGS_AMOUNT = 600
+
+
+def _get_logs() -> list:
+    '''
+    Returns ES hits of one day, one log every two minutes and a half.
+    '''
+    return [
+        {
+            '_source': {
+                'message': 'a log message number {}'.format(counter),
+                'level': 'a low level',
+                'category': 'a category',
+                'date': '2017-08-09T{:02d}:{:02d}:{:02d}'.format(
+                    counter * 150 // 3600,
+                    counter * 150 % 3600 // 60,
+                    counter * 150 % 60,
+                ),
+                'service_id': '1',
+            }
+        }
+        for counter in range(LOGS_AMOUNT)
+    ]
+
+
+def _write_archive(
+    compression: str,
+    monkeypatch,
+) -> tuple:
+    '''
+    Writes the logs into an archive of small blocks,
+    returns the archive, its index and its lines.
+    '''
+    monkeypatch.setattr(create_snapshot, 'ARCHIVE_BLOCK_BYTES', 4096)
+
+    logs = _get_logs()
+    output = io.BytesIO()
+
+    writer = create_snapshot._ArchiveWriter(output, compression)
+    for log in logs:
+        writer.write(log)
+    writer.close()
+
+    lines = b''.join(
+        create_snapshot._get_log_to_string(log).encode()
+        for log in logs
+    )
+
+    return output.getvalue(), writer._blocks, lines
+
+
+def _decompress(
+    data: bytes,
+    chunk_size: int,
+) -> bytes:
+    '''
+    Decompresses the given archive read by chunks of the given size.
+    '''
+    decompressor = _ArchiveDecompressor()
+
+    output = [
+        decompressor.decompress(data[start:start + chunk_size])
+        for start in range(0, len(data), chunk_size)
+    ]
+    output.append(decompressor.flush())
+
+    return b''.join(output)
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_frames_split_at_any_chunk_boundary(compression, monkeypatch):
+    '''
+    Reads an archive made of many frames by chunks of different sizes,
+    checks that the lines are read back as they were written.
+    '''
+    data, blocks, lines = _write_archive(compression, monkeypatch)
+    assert len(blocks) > 1
+
+    for chunk_size in CHUNKS_SIZES:
+        assert _decompress(data, chunk_size) == lines
+
+
+def test_blocks_of_one_date(monkeypatch):
+    '''
+    Writes logs of the same date into an archive of small blocks,
+    checks that the blocks are closed at their size
+    and that the lines of the date are read from all of them.
+    '''
+    monkeypatch.setattr(create_snapshot, 'ARCHIVE_BLOCK_BYTES', 4096)
+
+    logs = [
+        {
+            '_source': {
+                'message': 'a log message number {}'.format(counter),
+                'date': '2017-08-09T12:00:00',
+            }
+        }
+        for counter in range(LOGS_AMOUNT)
+    ]
+    line_bytes = max(
+        len(create_snapshot._get_log_to_string(log).encode())
+        for log in logs
+    )
+
+    output = io.BytesIO()
+    writer = create_snapshot._ArchiveWriter(output, 'none')
+    for log in logs:
+        writer.write(log)
+    writer.close()
+
+    assert len(writer._blocks) > 1
+    assert all(
+        block[3] < 4096 + line_bytes
+        for block in writer._blocks
+    )
+    assert get_archive_ranges(
+        {'blocks': writer._blocks},
+        '2017-08-09T12:00:00',
+        '2017-08-09T12:00:00',
+    ) == [[0, len(output.getvalue()) - 1]]
+
+
+@pytest.mark.parametrize(
+    'compression',
+    [compression for compression in COMPRESSIONS if compression != 'none'],
+)
+def test_truncated_frame(compression, monkeypatch):
+    '''
+    Reads an archive which last frame is truncated,
+    checks that an archive error is raised.
+    '''
+    data, _, _ = _write_archive(compression, monkeypatch)
+
+    with pytest.raises(ArchiveError):
+        _decompress(data[:-5], 1000)
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_ranges_of_blocks(compression, monkeypatch):
+    '''
+    Reads only the blocks of an archive overlapping a dates range,
+    checks that all the lines of the range are read.
+    '''
+    data, blocks, lines = _write_archive(compression, monkeypatch)
+
+    start_date = '2017-08-09T06:00:00'
+    end_date = '2017-08-09T08:30:00'
+
+    ranges = get_archive_ranges(
+        {'blocks': blocks},
+        start_date,
+        end_date,
+    )
+    assert len(ranges) == 1
+
+    read_lines = b''.join(
+        _decompress(data[first_byte:last_byte + 1], 1000)
+        for first_byte, last_byte in ranges
+    )
+
+    assert len(read_lines) < len(lines)
+    assert get_lines_in_range(
+        read_lines,
+        start_date.encode(),
+        end_date.encode(),
+    ) == get_lines_in_range(
+        lines,
+        start_date.encode(),
+        end_date.encode(),
+    )
+
+
+def test_nested_date_field():
+    '''
+    Filters the lines of logs with a date nested into another field,
+    checks that they are filtered by their own date.
+    '''
+    logs = [
+        {
+            '_source': {
+                'message': 'a log message',
+                'context': {'date': '2017-08-09T{:02d}:00:00'.format(hour)},
+                'date': '2017-08-09T{:02d}:00:00'.format(23 - hour),
+            }
+        }
+        for hour in range(24)
+    ]
+
+    lines = b''.join(
+        create_snapshot._get_log_to_string(log).encode()
+        for log in logs
+    )
+
+    assert get_lines_in_range(
+        lines,
+        b'2017-08-09T00:00:00',
+        b'2017-08-09T01:59:59',
+    ) == [
+        create_snapshot._get_log_to_string(log).encode().rstrip()
+        for log in logs[22:]
+    ]
+
+
+def test_adjacent_ranges_merge():
+    '''
+    Checks that the contiguous blocks overlapping a dates range
+    are merged into one bytes range.
+    '''
+    index = {
+        'blocks': [
+            ['2017-08-09T00:00:00', '2017-08-09T00:59:59', 0, 100],
+            ['2017-08-09T01:00:00', '2017-08-09T01:59:59', 100, 50],
+            ['2017-08-09T02:00:00', '2017-08-09T02:59:59', 150, 70],
+            ['2017-08-09T03:00:00', '2017-08-09T03:59:59', 220, 30],
+        ]
+    }
+
+    assert get_archive_ranges(
+        index,
+        '2017-08-09T01:30:00',
+        '2017-08-09T02:30:00',
+    ) == [[100, 219]]
+
+    assert get_archive_ranges(
+        index,
+        '2017-08-09T00:00:00',
+        '2017-08-09T23:59:59',
+    ) == [[0, 249]]
+
+    # blocks of the other slices of the day may be between the blocks
+    index['blocks'][2][2] = 200
+    index['blocks'][3][2] = 270
+
+    assert get_archive_ranges(
+        index,
+        '2017-08-09T01:30:00',
+        '2017-08-09T03:30:00',
+    ) == [[100, 149], [200, 299]]
+
+
+class _Body:
+    '''
+    Body of one S3 object, read by chunks.
+    '''
+
+    def __init__(
+        self,
+        data: bytes,
+        loop: asyncio.AbstractEventLoop=None,
+        delay: float=0,
+    ):
+        self._data = data
+        self._loop = loop
+        self._delay = delay
+
+    async def read(self, size: int=-1) -> bytes:
+        '''
+        Returns the next bytes of the object, after the given delay.
+        '''
+        if self._delay:
+            await asyncio.sleep(self._delay, loop=self._loop)
+
+        if size < 0:
+            size = len(self._data)
+
+        data = self._data[:size]
+        self._data = self._data[size:]
+        return data
+
+    def close(self):
+        '''
+        Closes the body.
+        '''
+        pass
+
+
+class _S3Client:
+    '''
+    S3 client returning the given objects,
+    read with the given delays by key.
+    '''
+
+    def __init__(
+        self,
+        objects: dict,
+        loop: asyncio.AbstractEventLoop=None,
+        delays: dict=None,
+    ):
+        self._objects = objects
+        self._loop = loop
+        self._delays = delays or {}
+
+    async def get_object(self, Bucket: str, Key: str) -> dict:
+        '''
+        Returns the object of the given key.
+        '''
+        if Key not in self._objects:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'NoSuchKey'}},
+                'GetObject',
+            )
+
+        return {
+            'Body': _Body(
+                self._objects[Key],
+                self._loop,
+                self._delays.get(Key, 0),
+            ),
+        }
+
+
+def test_plain_archive_without_index():
+    '''
+    Gets an archive created before the archives were indexed and compressed,
+    checks that its lines of the dates range are returned.
+    '''
+    loop = asyncio.new_event_loop()
+
+    # lines written like the snapshots of that time
+    lines = b''.join(
+        (str(log['_source']).replace("'", '"') + '\n').encode()
+        for log in _get_logs()
+    )
+
+    fetcher = ArchivesFetcher(
+        _S3Client({'data-1-2017-08-09': lines}),
+        ['data-1-2017-08-09'],
+        '2017-08-09T00:00:00',
+        '2017-08-09T23:59:59',
+        loop,
+    )
+    fetcher.start()
+
+    read_lines = b''
+    chunk = loop.run_until_complete(fetcher.next_chunk())
+    while chunk:
+        read_lines += chunk
+        chunk = loop.run_until_complete(fetcher.next_chunk())
+
+    loop.close()
+
+    assert read_lines == lines
+
+
+def test_archives_completed_out_of_order(monkeypatch):
+    '''
+    Gets several archives, the last ones read faster than the first ones,
+    checks that their lines are returned in the keys order
+    and that the buffered bytes stay within the maximum.
+    '''
+    monkeypatch.setattr('logs.archives.S3_READ_CHUNK_BYTES', 500)
+    loop = asyncio.new_event_loop()
+
+    logs = _get_logs()
+    keys = ['data-1-2017-08-{:02d}'.format(day) for day in range(1, 5)]
+    archives_lines = {
+        key: b''.join(
+            create_snapshot._get_log_to_string(log).encode()
+            for log in logs[position * 150:(position + 1) * 150]
+        )
+        for position, key in enumerate(keys)
+    }
+
+    fetcher = ArchivesFetcher(
+        _S3Client(
+            archives_lines,
+            loop,
+            {
+                key: 0.004 * (len(keys) - position)
+                for position, key in enumerate(keys)
+            },
+        ),
+        keys,
+        '2017-08-01T00:00:00',
+        '2017-08-04T23:59:59',
+        loop,
+        maximum_archives=3,
+        maximum_bytes=3000,
+    )
+
+    buffered_bytes = []
+    put_chunk = fetcher._put_chunk
+
+    async def put_chunk_and_measure(position, queue, chunk):
+        await put_chunk(position, queue, chunk)
+        buffered_bytes.append((fetcher._buffered_bytes, len(chunk)))
+
+    fetcher._put_chunk = put_chunk_and_measure
+    fetcher.start()
+
+    read_lines = b''
+    chunk = loop.run_until_complete(fetcher.next_chunk())
+    while chunk:
+        read_lines += chunk
+        chunk = loop.run_until_complete(fetcher.next_chunk())
+
+    loop.close()
+
+    assert read_lines == b''.join(archives_lines[key] for key in keys)
+    assert all(
+        buffered <= 3000 + chunk_bytes
+        for buffered, chunk_bytes in buffered_bytes
+    )
@@ -0,0 +1,143 @@
+'''
+Tests for the bulk requests
+'''
+import asyncio
+
+import aiohttp
+import pytest
+
+import logs.bulk
+from logs.bulk import BulkError
+from logs.bulk import get_bulk_entries
+from logs.bulk import send_bulk
+
+from logs.config import ELASTICSEARCH_BULK_MAXIMUM_ATTEMPTS
+
+
+def _send_bulk(
+    monkeypatch,
+    post_bulk: callable,
+    entries: list,
+) -> list:
+    '''
+    Sends the given entries with the given fake bulk request,
+    without waiting between the attempts; returns their results.
+    '''
+    monkeypatch.setattr(logs.bulk, '_post_bulk', post_bulk)
+    monkeypatch.setattr(logs.bulk, '_get_backoff_seconds', lambda attempt: 0)
+
+    loop = asyncio.get_event_loop()
+
+    return loop.run_until_complete(
+        send_bulk(
+            None,
+            asyncio.Semaphore(loop=loop),
+            entries,
+        )
+    )
+
+
+def _get_entries(amount: int) -> list:
+    '''
+    Returns the given amount of bulk entries.
+    '''
+    return get_bulk_entries(
+        'data-1-2017-08-09',
+        [
+            {'message': 'log message {}'.format(counter)}
+            for counter in range(amount)
+        ],
+    )
+
+
+def test_retry_rejected_entries(monkeypatch):
+    '''
+    Sends entries half rejected because ES is overloaded,
+    checks that only the rejected entries are sent again
+    and that every result is at the position of its entry.
+    '''
+    entries = _get_entries(4)
+    bodies = []
+    statuses = [
+        [201, 429, 201, 429],
+        [201, 201],
+    ]
+
+    async def post_bulk(session, body):
+        bodies.append(body)
+        return [
+            {'status': status, 'attempt': len(bodies)}
+            for status in statuses[len(bodies) - 1]
+        ]
+
+    results = _send_bulk(monkeypatch, post_bulk, entries)
+
+    assert bodies == [
+        b''.join(entries),
+        b''.join([entries[1], entries[3]]),
+    ]
+    assert [result['status'] for result in results] == [201] * 4
+    assert [result['attempt'] for result in results] == [1, 2, 1, 2]
+
+
+def test_always_rejected_entries(monkeypatch):
+    '''
+    Sends entries ES always rejects because it is overloaded,
+    checks that the last rejection is returned after the maximum attempts.
+    '''
+    entries = _get_entries(2)
+    bodies = []
+
+    async def post_bulk(session, body):
+        bodies.append(body)
+        rejected = {'status': 429, 'error': 'rejected {}'.format(len(bodies))}
+
+        # only the rejected entry is sent again
+        if len(bodies) == 1:
+            return [{'status': 201}, rejected]
+        return [rejected]
+
+    results = _send_bulk(monkeypatch, post_bulk, entries)
+
+    assert len(bodies) == ELASTICSEARCH_BULK_MAXIMUM_ATTEMPTS
+    assert results[0] == {'status': 201}
+    assert results[1] == {
+        'status': 429,
+        'error': 'rejected {}'.format(ELASTICSEARCH_BULK_MAXIMUM_ATTEMPTS),
+    }
+
+
+def test_unreachable_elasticsearch(monkeypatch):
+    '''
+    Sends entries while ES cannot be reached,
+    checks that every entry gets an unavailable result.
+    '''
+    entries = _get_entries(2)
+    attempts = []
+
+    async def post_bulk(session, body):
+        attempts.append(body)
+        raise aiohttp.ClientError('connection refused')
+
+    results = _send_bulk(monkeypatch, post_bulk, entries)
+
+    assert len(attempts) == ELASTICSEARCH_BULK_MAXIMUM_ATTEMPTS
+    assert [result['status'] for result in results] == [503, 503]
+    assert 'connection refused' in results[0]['error']
+
+
+def test_refused_request(monkeypatch):
+    '''
+    Sends entries ES refuses entirely with a status
+    that cannot change, checks that the error is raised at once.
+    '''
+    attempts = []
+
+    async def post_bulk(session, body):
+        attempts.append(body)
+        raise BulkError(400, {'error': 'malformed bulk request'})
+
+    with pytest.raises(BulkError):
+        _send_bulk(monkeypatch, post_bulk, _get_entries(2))
+
+    assert len(attempts) == 1
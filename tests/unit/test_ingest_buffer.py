@@ -0,0 +1,200 @@
+'''
+Tests for the ingest buffer
+'''
+import asyncio
+
+import logs.ingest_buffer
+from logs.bulk import BulkError
+from logs.bulk import get_bulk_entries
+from logs.ingest_buffer import IngestBuffer
+
+
+def _get_entries(
+    first_counter: int,
+    amount: int,
+) -> list:
+    '''
+    Returns the given amount of bulk entries.
+    '''
+    return get_bulk_entries(
+        'data-1-2017-08-09',
+        [
+            {'message': 'log message {}'.format(counter)}
+            for counter in range(first_counter, first_counter + amount)
+        ],
+    )
+
+
+def _get_buffer(
+    monkeypatch,
+    sent_batches: list,
+    **parameters
+) -> tuple:
+    '''
+    Returns an event loop and an ingest buffer
+    which bulk requests are added to the given list.
+    '''
+    async def send_bulk(session, semaphore, entries):
+        sent_batches.append([bytes(entry) for entry in entries])
+        return [
+            {'status': 201, 'entry': bytes(entry)}
+            for entry in entries
+        ]
+
+    monkeypatch.setattr(logs.ingest_buffer, 'send_bulk', send_bulk)
+
+    loop = asyncio.new_event_loop()
+    parameters.setdefault('flush_interval', 60)
+
+    return loop, IngestBuffer(None, loop, **parameters)
+
+
+def _run_flushes(loop: asyncio.AbstractEventLoop):
+    '''
+    Lets the started flushes run.
+    '''
+    loop.run_until_complete(asyncio.sleep(0.01, loop=loop))
+
+
+def test_flush_on_logs_amount(monkeypatch):
+    '''
+    Adds entries up to the logs amount threshold,
+    checks that they are sent in one bulk request.
+    '''
+    sent_batches = []
+    loop, ingest_buffer = _get_buffer(
+        monkeypatch,
+        sent_batches,
+        maximum_logs=3,
+    )
+
+    ingest_buffer.add('1', _get_entries(0, 2))
+    _run_flushes(loop)
+    assert sent_batches == []
+
+    ingest_buffer.add('1', _get_entries(2, 1))
+    _run_flushes(loop)
+    loop.close()
+
+    assert sent_batches == [
+        [bytes(entry) for entry in _get_entries(0, 3)],
+    ]
+
+
+def test_flush_on_bytes_amount(monkeypatch):
+    '''
+    Adds entries up to the bytes amount threshold,
+    checks that they are sent in one bulk request.
+    '''
+    entries = _get_entries(0, 2)
+
+    sent_batches = []
+    loop, ingest_buffer = _get_buffer(
+        monkeypatch,
+        sent_batches,
+        maximum_bytes=len(entries[0]) + len(entries[1]),
+    )
+
+    ingest_buffer.add('1', entries[:1])
+    _run_flushes(loop)
+    assert sent_batches == []
+
+    ingest_buffer.add('2', entries[1:])
+    _run_flushes(loop)
+    loop.close()
+
+    assert sent_batches == [[bytes(entry) for entry in entries]]
+
+
+def test_flush_on_interval(monkeypatch):
+    '''
+    Adds entries under the thresholds,
+    checks that they are sent after the flush interval.
+    '''
+    sent_batches = []
+    loop, ingest_buffer = _get_buffer(
+        monkeypatch,
+        sent_batches,
+        flush_interval=0.05,
+    )
+    ingest_buffer.start()
+
+    ingest_buffer.add('1', _get_entries(0, 1))
+    _run_flushes(loop)
+    assert sent_batches == []
+
+    loop.run_until_complete(asyncio.sleep(0.1, loop=loop))
+    loop.run_until_complete(ingest_buffer.close())
+    loop.close()
+
+    assert sent_batches == [[bytes(entry) for entry in _get_entries(0, 1)]]
+
+
+def test_waiters_results(monkeypatch):
+    '''
+    Adds the entries of several requests waiting for their results,
+    sent in one bulk request, checks that every request gets the results
+    of its own entries.
+    '''
+    sent_batches = []
+    loop, ingest_buffer = _get_buffer(
+        monkeypatch,
+        sent_batches,
+        maximum_logs=6,
+    )
+
+    ingest_buffer.add('1', _get_entries(0, 1))
+    first_waiter = ingest_buffer.add('1', _get_entries(1, 2), wait=True)
+    ingest_buffer.add('2', _get_entries(3, 1))
+    second_waiter = ingest_buffer.add('2', _get_entries(4, 2), wait=True)
+
+    first_results = loop.run_until_complete(first_waiter)
+    second_results = loop.run_until_complete(second_waiter)
+    loop.close()
+
+    assert len(sent_batches) == 1
+    assert [result['entry'] for result in first_results] == [
+        bytes(entry) for entry in _get_entries(1, 2)
+    ]
+    assert [result['entry'] for result in second_results] == [
+        bytes(entry) for entry in _get_entries(4, 2)
+    ]
+
+
+def test_pending_bytes_released(monkeypatch):
+    '''
+    Adds entries of two services, indexed then failing,
+    checks that their pending bytes are released in both cases.
+    '''
+    sent_batches = []
+    loop, ingest_buffer = _get_buffer(
+        monkeypatch,
+        sent_batches,
+        maximum_logs=2,
+    )
+
+    ingest_buffer.add('1', _get_entries(0, 1))
+    ingest_buffer.add('2', _get_entries(1, 1))
+    assert ingest_buffer.get_stats()['pending_bytes'] > 0
+
+    _run_flushes(loop)
+
+    assert ingest_buffer.get_stats()['pending_bytes'] == 0
+    assert ingest_buffer.get_stats()['indexed_logs'] == 2
+    assert not +ingest_buffer._pending_bytes_per_service
+
+    async def send_bulk(session, semaphore, entries):
+        raise BulkError(400, {})
+
+    monkeypatch.setattr(logs.ingest_buffer, 'send_bulk', send_bulk)
+
+    ingest_buffer.add('1', _get_entries(2, 1))
+    waiter = ingest_buffer.add('2', _get_entries(3, 1), wait=True)
+
+    loop.run_until_complete(asyncio.wait([waiter], loop=loop))
+    loop.close()
+
+    assert isinstance(waiter.exception(), BulkError)
+    assert ingest_buffer.get_stats()['pending_bytes'] == 0
+    assert ingest_buffer.get_stats()['failed_logs'] == 2
+    assert not +ingest_buffer._pending_bytes_per_service
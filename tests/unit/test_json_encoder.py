@@ -0,0 +1,53 @@
+'''
+Tests for the JSON encoder
+'''
+import json
+
+import pytest
+
+import logs.json_encoder
+from logs.bulk import get_bulk_body
+from logs.bulk import get_bulk_entries
+from logs.json_encoder import encode
+
+ENCODERS = [logs.json_encoder._encode_with_json]
+if logs.json_encoder.orjson is not None:
+    ENCODERS.append(logs.json_encoder._encode_with_orjson)
+if logs.json_encoder.ujson is not None:
+    ENCODERS.append(logs.json_encoder._encode_with_ujson)
+
+LOG = {
+    'message': 'a log message with an apostrophe \' and an accent é',
+    'level': 'a low level',
+    'category': 'a category',
+    'date': '2017-08-09T18:56:12',
+    'service_id': '1',
+}
+
+
+@pytest.mark.parametrize('encoder', ENCODERS)
+def test_encode(encoder, monkeypatch):
+    '''
+    Encodes one log with every available encoder,
+    checks that it is decoded as it was.
+    '''
+    monkeypatch.setattr(logs.json_encoder, '_encode_fast', encoder)
+
+    assert json.loads(encode(LOG).decode()) == LOG
+
+
+@pytest.mark.parametrize('encoder', ENCODERS)
+def test_encode_integer_out_of_64_bits(encoder, monkeypatch):
+    '''
+    Encodes one log with an integer too large for the fast encoders,
+    checks that its bulk entry is encoded anyway.
+    '''
+    monkeypatch.setattr(logs.json_encoder, '_encode_fast', encoder)
+
+    log = dict(LOG, counter=123456789012345678901234567890)
+
+    body = get_bulk_body(get_bulk_entries('data-1-2017-08-09', [LOG, log]))
+    lines = body.decode().splitlines()
+
+    assert len(lines) == 4
+    assert json.loads(lines[3]) == log
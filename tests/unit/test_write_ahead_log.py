@@ -0,0 +1,252 @@
+'''
+Tests for the write-ahead log
+'''
+import asyncio
+import os
+
+import logs.write_ahead_log
+from logs.bulk import BulkError
+from logs.bulk import get_bulk_entries
+from logs.write_ahead_log import WriteAheadLog
+from logs.write_ahead_log import _get_entries
+from logs.write_ahead_log import _get_record
+
+
+def _get_entries_to_write(amount: int) -> list:
+    '''
+    Returns bulk entries, as written by the ingest buffer;
+    every other source line starts like an action line.
+    '''
+    return [
+        bytes(entry)
+        for entry in get_bulk_entries(
+            'data-1-2017-08-09',
+            [
+                {
+                    'index': 'an index field',
+                    'message': 'log message {}'.format(counter),
+                }
+                if counter % 2 else
+                {
+                    'message': 'log message {}'.format(counter),
+                }
+                for counter in range(amount)
+            ],
+        )
+    ]
+
+
+def _write_segment(
+    tmpdir,
+    sequence: int,
+    entries: list,
+    end: bytes=b'',
+) -> int:
+    '''
+    Writes a segment left by a previous run, followed by the given bytes;
+    returns the size of the segment.
+    '''
+    data = b''.join(_get_record(entry) for entry in entries) + end
+    tmpdir.join('{:020d}.wal'.format(sequence)).write_binary(data)
+
+    return len(data)
+
+
+def _get_segments(directory: str) -> list:
+    '''
+    Returns the names of the segments of the given directory, in order.
+    '''
+    return sorted(
+        name
+        for name in os.listdir(directory)
+        if name.endswith('.wal')
+    )
+
+
+def _replay(
+    loop: asyncio.AbstractEventLoop,
+    write_ahead_log: WriteAheadLog,
+    monkeypatch,
+    send_bulk: callable,
+) -> list:
+    '''
+    Replays the sealed segments of the given log with the given
+    bulk function, returns the sizes of the released segments.
+    '''
+    monkeypatch.setattr(logs.write_ahead_log, 'send_bulk', send_bulk)
+    monkeypatch.setattr(logs.write_ahead_log, 'INGEST_WAL_RETRY_SECONDS', 0)
+
+    released = []
+    replay = asyncio.ensure_future(
+        write_ahead_log.replay(
+            None,
+            asyncio.Semaphore(loop=loop),
+            lambda size, services_bytes: released.append(size),
+        ),
+        loop=loop,
+    )
+    loop.run_until_complete(asyncio.sleep(0.1, loop=loop))
+    replay.cancel()
+
+    return released
+
+
+def test_segments_rotation(tmpdir):
+    '''
+    Appends entries to a log with small segments,
+    checks that full segments are sealed and that no entry is lost.
+    '''
+    loop = asyncio.new_event_loop()
+    directory = str(tmpdir)
+    entries = _get_entries_to_write(10)
+
+    write_ahead_log = WriteAheadLog(
+        directory,
+        loop,
+        segment_bytes=len(entries[0]) * 3,
+        segment_seconds=60,
+    )
+    writer = asyncio.ensure_future(write_ahead_log.write(), loop=loop)
+
+    for entry in entries:
+        loop.run_until_complete(write_ahead_log.append('1', [entry]))
+
+    loop.run_until_complete(write_ahead_log.close(writer))
+    loop.close()
+
+    segments = _get_segments(directory)
+    assert len(segments) == 4
+
+    read_entries = []
+    for segment in segments:
+        with open(os.path.join(directory, segment), 'rb') as segment_file:
+            read_entries += _get_entries(segment_file.read())[0]
+
+    assert read_entries == entries
+
+
+def test_replay(tmpdir, monkeypatch):
+    '''
+    Replays the segments left by a previous run,
+    checks that all the entries are sent in order
+    and that the acknowledged segments are removed.
+    '''
+    loop = asyncio.new_event_loop()
+    directory = str(tmpdir)
+    entries = _get_entries_to_write(4)
+
+    sizes = [
+        _write_segment(
+            tmpdir,
+            sequence,
+            entries[sequence * 2:sequence * 2 + 2],
+        )
+        for sequence in range(2)
+    ]
+
+    write_ahead_log = WriteAheadLog(directory, loop)
+    assert write_ahead_log.get_recovered_bytes() == sum(sizes)
+
+    sent_entries = []
+
+    async def send_bulk(session, semaphore, bulk_entries):
+        sent_entries.extend(bulk_entries)
+        return [{'status': 201}] * len(bulk_entries)
+
+    released = _replay(loop, write_ahead_log, monkeypatch, send_bulk)
+    loop.close()
+
+    assert sent_entries == entries
+    assert released == sizes
+    assert write_ahead_log.indexed_logs == 4
+    assert _get_segments(directory) == []
+
+
+def test_torn_entry_recovery(tmpdir, monkeypatch):
+    '''
+    Replays a segment ending with an entry torn by an abrupt stop,
+    checks that only the complete entries are sent.
+    '''
+    loop = asyncio.new_event_loop()
+    entries = _get_entries_to_write(3)
+
+    _write_segment(
+        tmpdir,
+        0,
+        entries[:2],
+        _get_record(entries[2])[:-10],
+    )
+
+    write_ahead_log = WriteAheadLog(str(tmpdir), loop)
+
+    sent_entries = []
+
+    async def send_bulk(session, semaphore, bulk_entries):
+        sent_entries.extend(bulk_entries)
+        return [{'status': 201}] * len(bulk_entries)
+
+    _replay(loop, write_ahead_log, monkeypatch, send_bulk)
+    loop.close()
+
+    assert sent_entries == entries[:2]
+
+
+def test_replay_drops_refused_entries(tmpdir, monkeypatch):
+    '''
+    Replays a segment ES always refuses entirely,
+    checks that its entries are dropped after the maximum attempts.
+    '''
+    loop = asyncio.new_event_loop()
+    size = _write_segment(tmpdir, 0, _get_entries_to_write(2))
+
+    write_ahead_log = WriteAheadLog(str(tmpdir), loop)
+
+    async def send_bulk(session, semaphore, bulk_entries):
+        raise BulkError(400, {})
+
+    released = _replay(loop, write_ahead_log, monkeypatch, send_bulk)
+    loop.close()
+
+    assert released == [size]
+    assert write_ahead_log.failed_logs == 2
+    assert _get_segments(str(tmpdir)) == []
+
+
+def test_unopened_segment(tmpdir, monkeypatch):
+    '''
+    Appends entries when the segment file cannot be opened,
+    checks that the append fails without sealing any segment
+    and that the next entries are written and replayed.
+    '''
+    loop = asyncio.new_event_loop()
+    entries = _get_entries_to_write(2)
+
+    write_ahead_log = WriteAheadLog(str(tmpdir), loop)
+    writer = asyncio.ensure_future(write_ahead_log.write(), loop=loop)
+
+    def open_failing(path, mode):
+        raise OSError(28, 'No space left on device')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(logs.write_ahead_log, 'open', open_failing, False)
+
+        written = write_ahead_log.append('1', entries[:1])
+        loop.run_until_complete(asyncio.wait([written], loop=loop))
+
+    assert written.exception() is not None
+    assert write_ahead_log.get_recovered_bytes() == 0
+
+    loop.run_until_complete(write_ahead_log.append('1', entries[1:]))
+    loop.run_until_complete(write_ahead_log.close(writer))
+
+    sent_entries = []
+
+    async def send_bulk(session, semaphore, bulk_entries):
+        sent_entries.extend(bulk_entries)
+        return [{'status': 201}] * len(bulk_entries)
+
+    released = _replay(loop, write_ahead_log, monkeypatch, send_bulk)
+    loop.close()
+
+    assert sent_entries == entries[1:]
+    assert released == [len(entries[1])]